@@ -0,0 +1,190 @@
+"""Benchmarks every server.py endpoint against the stub APIs, cold and warm, at several concurrency levels.
+
+For every endpoint and concurrency level a fresh server is started. The cold phase sends one
+wave of `concurrency` simultaneous requests at empty caches; the warm phase then sends
+--requests more at the same concurrency. Reports p50/p99 latency, throughput, upstream calls
+per request and the server's peak RSS.
+
+    python bench/run_bench.py --concurrency 1,8,32 --requests 200 --latency-ms 80
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from serve import BENCH_API_KEY  # noqa: E402
+
+ENDPOINTS = [
+    "/schedule",
+    "/schedule?stream=1",
+    "/next_shift",
+    "/summary",
+    "/working_today",
+    "/working_tomorrow",
+    "/next_day_off",
+]
+
+
+def wait_until_up(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} didn't come up within {timeout}s")
+
+
+def peak_rss_mb(pid: int):
+    # VmHWM is the process's peak resident set size, only available on Linux
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def drive(url: str, total: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async with httpx.AsyncClient(
+        headers={"X-API-Key": BENCH_API_KEY},
+        timeout=60,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    ) as client:
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    r = await client.get(url)
+                    await r.aread()
+                    status = r.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "ok": statuses.get(200, 0),
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "throughput_rps": total / elapsed,
+    }
+
+
+def stub_calls(stub_url: str) -> int:
+    return httpx.get(f"{stub_url}/_stats").json()["total"]
+
+
+def run_case(args, endpoint: str, concurrency: int) -> list:
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(args.server_port), "--stub-url", args.stub_url],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    server_url = f"http://127.0.0.1:{args.server_port}"
+    try:
+        wait_until_up(f"{server_url}/metrics")
+        rows = []
+        for phase, total in (("cold", concurrency), ("warm", args.requests)):
+            httpx.post(f"{args.stub_url}/_reset")
+            result = asyncio.run(drive(server_url + endpoint, total, concurrency))
+            result.update({
+                "endpoint": endpoint,
+                "concurrency": concurrency,
+                "phase": phase,
+                "upstream_per_request": stub_calls(args.stub_url) / total,
+                "peak_rss_mb": peak_rss_mb(server.pid),
+            })
+            rows.append(result)
+        return rows
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def print_table(rows: list) -> None:
+    header = f"{'endpoint':<20} {'conc':>4} {'phase':<5} {'n':>5} {'ok':>5} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'up/req':>7} {'rss MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        rss = f"{row['peak_rss_mb']:.0f}" if row["peak_rss_mb"] is not None else "n/a"
+        print(
+            f"{row['endpoint']:<20} {row['concurrency']:>4} {row['phase']:<5} {row['requests']:>5} {row['ok']:>5} "
+            f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['throughput_rps']:>8.1f} "
+            f"{row['upstream_per_request']:>7.2f} {rss:>7}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=200, help="requests per warm phase")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--server-port", type=int, default=9101)
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    args = parser.parse_args()
+    args.stub_url = f"http://127.0.0.1:{args.stub_port}"
+
+    stub = subprocess.Popen(
+        [
+            sys.executable, os.path.join(BENCH_DIR, "stub_server.py"),
+            "--port", str(args.stub_port),
+            "--latency-ms", str(args.latency_ms),
+            "--jitter-ms", str(args.jitter_ms),
+            "--error-rate", str(args.error_rate),
+            "--unauthorized-rate", str(args.unauthorized_rate),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(f"{args.stub_url}/_stats")
+        rows = []
+        for endpoint in args.endpoints.split(","):
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                rows.extend(run_case(args, endpoint, concurrency))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print_table(rows)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Runs server.py against bench/stub_server.py with a throwaway tenant and token. Used by run_bench.py."""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_API_KEY = "bench"
+# Relative to the repository root, functions.py changes into it on import
+TOKEN_PATH = os.path.join("bench", ".bench_token.cfg")
+
+
+def configure(stub_url: str, log_level: str = "WARNING") -> None:
+    import config_file
+
+    config_file.TARGET_API_BASE_URL = stub_url
+    config_file.REDSKY_BASE_URL = stub_url
+    config_file.PUSHOVER_BASE_URL = stub_url
+    config_file.TENANTS = [
+        {
+            "name": "bench",
+            "api_key": BENCH_API_KEY,
+            "employee_id": 1234567,
+            "password": "bench",
+            "store_number": 1375,
+            "token_path": TOKEN_PATH,
+        }
+    ]
+    # Measure the service itself: nothing shared with other runs, no background work skewing the counts
+    config_file.PERSISTENT_CACHE = False
+    config_file.RATE_LIMITS = {}
+    config_file.TOKEN_BACKGROUND_RENEWAL = False
+    config_file.SCHEDULE_BACKGROUND_REFRESH = False
+    config_file.SLOW_REQUEST_SECONDS = 3600
+    config_file.LOG_LEVEL = log_level
+    config_file.LOG_FILE = None
+
+    # The stub accepts any bearer, so a freshly validated dummy token never needs the browser
+    with open(os.path.join(ROOT, TOKEN_PATH), "w") as f:
+        f.write(f"[DEFAULT]\nbearer = Bearer bench\nvalidated = {time.time()}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--stub-url", default="http://127.0.0.1:9100")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL for the server")
+    args = parser.parse_args()
+
+    configure(args.stub_url, args.log_level)
+
+    import uvicorn
+    import server
+
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
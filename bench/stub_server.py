@@ -0,0 +1,195 @@
+"""Local stand-in for the Target and Pushover APIs, for benchmarks and offline testing.
+
+Run with:  python bench/stub_server.py --port 9100 --latency-ms 80 --error-rate 0.01
+and point TARGET_API_BASE_URL, REDSKY_BASE_URL and PUSHOVER_BASE_URL at http://127.0.0.1:9100.
+
+Any "Bearer ..." token is accepted. Latency, errors and 401s can also be changed while it runs
+through POST /_config, and GET /_stats returns how many calls each endpoint received.
+"""
+import argparse
+import asyncio
+import datetime
+import random
+import threading
+from collections import Counter
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI()
+
+settings = {
+    # Added to every response, plus up to jitter_ms at random
+    "latency_ms": 50.0,
+    "jitter_ms": 20.0,
+    # Share of calls answered 500 / 401
+    "error_rate": 0.0,
+    "unauthorized_rate": 0.0,
+}
+calls = Counter()
+_calls_lock = threading.Lock()
+
+JOBS = [
+    "STORE/GM/GENERAL MERCHANDISE EXPERT",
+    "STORE/FLOW/INBOUND TEAM MEMBER",
+    "STORE/GUEST ADVOCATE/FRONT END",
+    "STORE/FULFILLMENT/ORDER PICKER",
+]
+
+
+async def _simulate(request: Request, endpoint: str, needs_auth: bool = True) -> Optional[JSONResponse]:
+    # Counts the call, sleeps for the configured latency, and returns an error response if one is due
+    with _calls_lock:
+        calls[endpoint] += 1
+    await asyncio.sleep((settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])) / 1000)
+
+    if needs_auth:
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return JSONResponse({"message": "Unauthorized"}, status_code=401)
+        if random.random() < settings["unauthorized_rate"]:
+            return JSONResponse({"message": "Unauthorized"}, status_code=401)
+    if random.random() < settings["error_rate"]:
+        return JSONResponse({"message": "Internal Server Error"}, status_code=500)
+    return None
+
+
+def _week(employee_id: str, start_date: datetime.date, end_date: datetime.date) -> dict:
+    # Same schedule every time for a given employee and week
+    rng = random.Random(f"{employee_id}:{start_date}")
+    schedules = []
+    day = start_date
+    while day <= end_date:
+        segments = []
+        if rng.random() < 0.6:
+            start = datetime.datetime.combine(day, datetime.time(rng.choice([6, 7, 8, 9, 12, 14])))
+            end = start + datetime.timedelta(hours=rng.choice([4, 5, 6, 8]))
+            jobs = rng.sample(JOBS, rng.choice([1, 1, 1, 2]))
+            segments.append({
+                "segment_start": start.strftime("%Y-%m-%d %H:%M:%S"),
+                "segment_end": end.strftime("%Y-%m-%d %H:%M:%S"),
+                "job_name": jobs[0].split("/")[-1],
+                "total_jobs": len(jobs),
+                "location": "1375",
+                "jobs": [
+                    {
+                        "job_path": job,
+                        "job_start": start.strftime("%Y-%m-%d %H:%M:%S"),
+                        "job_end": end.strftime("%Y-%m-%d %H:%M:%S"),
+                    }
+                    for job in jobs
+                ],
+            })
+        schedules.append({
+            "schedule_date": day.isoformat(),
+            "total_display_segments": len(segments),
+            "display_segments": segments,
+            "total_hours": sum(
+                (datetime.datetime.fromisoformat(s["segment_end"]) - datetime.datetime.fromisoformat(s["segment_start"])).seconds / 3600
+                for s in segments
+            ),
+        })
+        day += datetime.timedelta(days=1)
+    return {
+        "team_member_number": employee_id,
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "schedules": schedules,
+    }
+
+
+@app.get("/wfm_schedules/v1/weekly_schedules")
+async def weekly_schedules(request: Request, team_member_number: str, start_date: datetime.date, end_date: datetime.date):
+    error = await _simulate(request, "weekly_schedules")
+    if error is not None:
+        return error
+    # functions.test_token asks for this week and takes a 400 to mean the token authenticated
+    if start_date == datetime.date(2020, 6, 23):
+        return JSONResponse({"message": "Bad Request"}, status_code=400)
+    return _week(team_member_number, start_date, end_date)
+
+
+@app.get("/wfm_available_shifts/v1/available_shifts")
+async def available_shifts(request: Request, worker_id: str, start_date: datetime.date, end_date: datetime.date, location_ids: str = ""):
+    error = await _simulate(request, "available_shifts")
+    if error is not None:
+        return error
+    rng = random.Random(f"{location_ids}:{start_date}")
+    shifts = []
+    for i in range(rng.choice([0, 0, 1, 2, 3])):
+        day = start_date + datetime.timedelta(days=rng.randrange((end_date - start_date).days + 1))
+        start = datetime.datetime.combine(day, datetime.time(rng.choice([6, 10, 14])))
+        hours = rng.choice([4, 6, 8])
+        shifts.append({
+            "available_shift_id": int(f"{day:%Y%m%d}{i}"),
+            "shift_start": start.isoformat(),
+            "shift_end": (start + datetime.timedelta(hours=hours)).isoformat(),
+            "shift_hours": hours - 0.5 if hours >= 5 else hours,
+            "org_structure": {"location_id": location_ids, "job": rng.choice(JOBS).split("/")[-1]},
+        })
+    return {"available_shifts": shifts}
+
+
+@app.get("/redsky_aggregations/v1/web/store_location_v1")
+async def store_location(request: Request, store_id: str):
+    error = await _simulate(request, "store_location", needs_auth=False)
+    if error is not None:
+        return error
+    return {
+        "data": {
+            "store": {
+                "store_id": store_id,
+                "mailing_address": {
+                    "address_line1": f"{store_id} Main St",
+                    "city": "Minneapolis",
+                    "region": "MN",
+                    "postal_code": "55403",
+                },
+            }
+        }
+    }
+
+
+@app.post("/1/messages.json")
+async def pushover(request: Request):
+    error = await _simulate(request, "pushover", needs_auth=False)
+    if error is not None:
+        return error
+    return {"status": 1, "request": "stub"}
+
+
+@app.post("/_config")
+async def update_config(request: Request):
+    settings.update({key: float(value) for key, value in (await request.json()).items() if key in settings})
+    return settings
+
+
+@app.get("/_stats")
+async def get_stats():
+    with _calls_lock:
+        return {"calls": dict(calls), "total": sum(calls.values())}
+
+
+@app.post("/_reset")
+async def reset_stats():
+    with _calls_lock:
+        calls.clear()
+    return {"total": 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    for key, value in settings.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value)
+    args = parser.parse_args()
+    for key in settings:
+        settings[key] = getattr(args, key)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
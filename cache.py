@@ -1,27 +1,336 @@
-from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+import asyncio
+import functools
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from loguru import logger
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    # Seconds since the value was stored
+    age: float
+    # Seconds until the value goes stale, negative once it already is
+    expires_in: float
+
 
 class Cache:
-    def __init__(self, ttl_seconds: int = 300):
-        self._cache: Dict[str, Dict[str, Any]] = {}
+    """Thread-safe TTL cache with LRU eviction once max_entries or max_bytes is exceeded.
+
+    namespace_ttls overrides ttl_seconds for keys starting with a given prefix,
+    e.g. {"wfm_": 300, "store_": 86400}. sweep_interval starts a daemon thread that
+    drops expired entries (and expired backend rows) in the background instead of waiting for a get().
+    max_stale_seconds keeps expired entries around that much longer so get_entry()
+    can still serve them while a refresh runs. backend (e.g. db.SQLiteCacheBackend)
+    gets a write-through copy of every entry and is read on local misses, so
+    restarts and other workers can pick entries up.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: int = 300,
+        max_entries: Optional[int] = 1024,
+        max_bytes: Optional[int] = None,
+        namespace_ttls: Optional[Dict[str, int]] = None,
+        sweep_interval: Optional[float] = None,
+        size_fn: Callable[[Any], int] = sys.getsizeof,
+        name: str = "cache",
+        max_stale_seconds: float = 0,
+        backend: Optional[Any] = None,
+    ):
+        # key -> (value, expires, size, stored); ordered from least to most recently used
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
         self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        # Longest prefix first so the most specific namespace wins
+        self._namespace_ttls = sorted(
+            (namespace_ttls or {}).items(), key=lambda item: len(item[0]), reverse=True
+        )
+        self._size_fn = size_fn
+        self._max_stale_seconds = max_stale_seconds
+        self._backend = backend
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
 
-    def get(self, key: str) -> Optional[Any]:
-        if key not in self._cache:
+        self._stop_sweeper = threading.Event()
+        if sweep_interval:
+            threading.Thread(
+                target=self._sweep_loop, args=(sweep_interval,), name=f"{name}-sweeper", daemon=True
+            ).start()
+
+    def _ttl_for(self, key: str) -> float:
+        for namespace, ttl in self._namespace_ttls:
+            if key.startswith(namespace):
+                return ttl
+        return self._ttl_seconds
+
+    def _remove(self, key: str) -> None:
+        size = self._cache.pop(key)[2]
+        self._bytes -= size
+
+    def _lookup(self, key: str) -> Optional[tuple]:
+        # Returns the local entry unless it is past both its TTL and the stale window
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() >= entry[1] + self._max_stale_seconds:
+                self._remove(key)
+                self.expirations += 1
+                return None
+            return entry
+
+    def _fetch(self, key: str) -> Optional[tuple]:
+        # Reads (value, stored_at, expires_at) from the persistent backend. Runs without self._lock
+        # held so a slow read never holds up other threads, and in a worker thread for the async getters.
+        if self._backend is None:
             return None
-        
-        cache_entry = self._cache[key]
-        if datetime.now() > cache_entry['expires']:
-            del self._cache[key]
+        try:
+            return self._backend.load(key)
+        except Exception as e:
+            logger.warning(f"Persistent cache read for {key} failed: {str(e)}")
             return None
-            
-        return cache_entry['data']
 
-    def set(self, key: str, value: Any) -> None:
-        self._cache[key] = {
-            'data': value,
-            'expires': datetime.now() + timedelta(seconds=self._ttl_seconds)
-        }
+    def _adopt(self, key: str, stored: Optional[tuple]) -> Optional[tuple]:
+        # Turns a backend row into a local entry, converting its wall clock times
+        if stored is None:
+            return None
+        value, stored_at, expires_at = stored
+        wall_now = time.time()
+        if wall_now >= expires_at + self._max_stale_seconds:
+            return None
+        size = self._size_fn(value) if self._max_bytes is not None else 0
+        with self._lock:
+            if key in self._cache:
+                # Set locally while we were reading, that copy is at least as new
+                return self._cache[key]
+            now = time.monotonic()
+            entry = (value, now + (expires_at - wall_now), size, now - (wall_now - stored_at))
+            self._cache[key] = entry
+            self._bytes += size
+            self._evict()
+            return entry
+
+    def _fresh(self, key: str, entry: Optional[tuple]) -> Optional[Any]:
+        with self._lock:
+            if entry is None or time.monotonic() >= entry[1]:
+                self.misses += 1
+                return None
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _with_age(self, key: str, entry: Optional[tuple]) -> Optional[CacheEntry]:
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.monotonic()
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            if now < entry[1]:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return CacheEntry(entry[0], now - entry[3], entry[1] - now)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._lookup(key)
+        if entry is None and self._backend is not None:
+            entry = self._adopt(key, self._fetch(key))
+        return self._fresh(key, entry)
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """Like get, but a backend read runs in a worker thread instead of on the event loop."""
+        entry = self._lookup(key)
+        if entry is None and self._backend is not None:
+            entry = self._adopt(key, await asyncio.to_thread(self._fetch, key))
+        return self._fresh(key, entry)
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        """Like get, but also returns stale entries (within max_stale_seconds) along with their age."""
+        entry = self._lookup(key)
+        if entry is None and self._backend is not None:
+            entry = self._adopt(key, self._fetch(key))
+        return self._with_age(key, entry)
+
+    async def get_entry_async(self, key: str) -> Optional[CacheEntry]:
+        entry = self._lookup(key)
+        if entry is None and self._backend is not None:
+            entry = self._adopt(key, await asyncio.to_thread(self._fetch, key))
+        return self._with_age(key, entry)
+
+    def _set_local(self, key: str, value: Any, ttl_seconds: Optional[float]) -> float:
+        ttl = self._ttl_for(key) if ttl_seconds is None else ttl_seconds
+        size = self._size_fn(value) if self._max_bytes is not None else 0
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+            now = time.monotonic()
+            self._cache[key] = (value, now + ttl, size, now)
+            self._bytes += size
+            self._evict()
+        return ttl
+
+    def _persist(self, key: str, value: Any, ttl: float) -> None:
+        wall_now = time.time()
+        try:
+            self._backend.store(key, value, wall_now, wall_now + ttl)
+        except Exception as e:
+            logger.warning(f"Persistent cache write for {key} failed: {str(e)}")
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        ttl = self._set_local(key, value, ttl_seconds)
+        if self._backend is not None:
+            self._persist(key, value, ttl)
+
+    async def set_async(self, key: str, value: Any, ttl_seconds: Optional[float] = None) -> None:
+        """Like set, but the backend write runs in a worker thread."""
+        ttl = self._set_local(key, value, ttl_seconds)
+        if self._backend is not None:
+            await asyncio.to_thread(self._persist, key, value, ttl)
+
+    def _evict(self) -> None:
+        # Drop least recently used entries until we're back under budget
+        while self._cache and (
+            (self._max_entries is not None and len(self._cache) > self._max_entries)
+            or (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            key = next(iter(self._cache))
+            self._remove(key)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._cache:
+                self._remove(key)
+        if self._backend is not None:
+            try:
+                self._backend.delete(key)
+            except Exception as e:
+                logger.warning(f"Persistent cache delete for {key} failed: {str(e)}")
+
+    def sweep(self) -> int:
+        """Removes every expired entry, returning how many were dropped."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                key
+                for key, entry in self._cache.items()
+                if now >= entry[1] + self._max_stale_seconds
+            ]
+            for key in expired:
+                self._remove(key)
+            self.expirations += len(expired)
+        if self._backend is not None:
+            # Other workers never delete rows they didn't read, so expired ones are dropped here
+            try:
+                self._backend.purge(time.time() - self._max_stale_seconds)
+            except Exception as e:
+                logger.warning(f"Persistent cache purge for {self.name} failed: {str(e)}")
+        return len(expired)
+
+    def _sweep_loop(self, interval: float) -> None:
+        while not self._stop_sweeper.wait(interval):
+            self.sweep()
+
+    def stop_sweeper(self) -> None:
+        self._stop_sweeper.set()
+
+    def clear(self, prefix: str = "") -> None:
+        """Drops every entry, or only those whose key starts with prefix."""
+        with self._lock:
+            if prefix:
+                for key in [key for key in self._cache if key.startswith(prefix)]:
+                    self._remove(key)
+            else:
+                self._cache.clear()
+                self._bytes = 0
+        if self._backend is not None:
+            try:
+                self._backend.clear(prefix)
+            except Exception as e:
+                logger.warning(f"Persistent cache clear for {self.name} failed: {str(e)}")
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._cache),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SingleFlight:
+    """Collapses concurrent loads of the same key into one call whose result every caller shares."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._async_calls: Dict[str, asyncio.Task] = {}
+        self._calls: Dict[str, "_Call"] = {}
+
+    async def do_async(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Awaits fn() once per key at a time; callers arriving meanwhile await the same result."""
+        task = self._async_calls.get(key)
+        if task is None:
+            # fn runs in a task of its own, so a caller that gives up (say a client that closed its
+            # stream) only stops waiting; the call carries on for everyone else sharing it
+            task = self._async_calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(functools.partial(self._finished, key))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._async_calls.get(key) is task:
+            del self._async_calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every caller had already gone
+            task.exception()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Thread version of do_async for the synchronous scripts."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
 
-    def clear(self) -> None:
-        self._cache.clear()
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[Exception] = None
@@ -0,0 +1,65 @@
+import threading
+import time
+
+from loguru import logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and allow() says no
+    for reset_seconds. Then a single probe call is let through (half open): its success
+    closes the circuit again, its failure reopens it for another reset_seconds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        # When the circuit opened, or when the current half open probe started
+        self._since = 0.0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now. A True in half open state makes the caller the probe."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            # A probe that never reported back doesn't keep the circuit half open forever
+            if now - self._since < self._reset_seconds:
+                return False
+            if self._state == OPEN:
+                logger.info(f"{self.name} circuit half open, sending a probe call")
+            self._state = HALF_OPEN
+            self._since = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != CLOSED:
+                logger.success(f"{self.name} circuit closed, upstream is answering again")
+            self._state = CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or (
+                self._state == CLOSED and self._failures >= self._failure_threshold
+            ):
+                logger.error(f"{self.name} circuit open after {self._failures} failures")
+                self._state = OPEN
+                self._since = time.monotonic()
+                self.opened += 1
@@ -19,6 +19,151 @@ headless = True
 totp = pyotp.TOTP("")
 # MFA code here.
 
+# How long (seconds) a verified bearer token is trusted before it is tested again.
+# Tokens carrying a JWT exp claim are trusted until that expiry instead.
+TOKEN_TRUST_SECONDS = 1800
+# Re-test or refresh the token this many seconds before it expires
+TOKEN_EXPIRY_MARGIN = 60
+# How long a request waits on another request's (or worker's) token refresh before failing
+TOKEN_REFRESH_WAIT_SECONDS = 120
+
+# Serve more than one employee from the same server. Each entry gets its own API key,
+# bearer token and cached schedules; leave empty to serve only the employee above.
+# The first tenant keeps its token in config.cfg, the others in config_<employee_id>.cfg
+# unless token_path is given. top.py and the scheduler run their jobs for every tenant, notifying
+# each at their own pushover_user_key; only the first defaults to PUSHOVER_USER_API_KEY.
+# TENANTS = [
+#     {"name": "alex", "api_key": "password", "employee_id": 00000000, "password": "myPassword",
+#      "store_number": 1375, "totp_secret": "", "pushover_user_key": ""},
+# ]
+TENANTS = []
+# How many tenants may run a browser login at the same time
+LOGIN_WORKERS = 1
+
+# Tokens are renewed in the background this many seconds before they'd need a test or a new login,
+# so requests don't wait for the browser. Failed renewals back off from RETRY to MAX_RETRY seconds.
+TOKEN_BACKGROUND_RENEWAL = True
+TOKEN_RENEW_AHEAD_SECONDS = 300
+TOKEN_RENEW_CHECK_SECONDS = 300
+TOKEN_RENEW_JITTER = 0.1
+TOKEN_RENEW_RETRY_SECONDS = 30
+TOKEN_RENEW_MAX_RETRY_SECONDS = 900
+
+# The login browser stays open between token refreshes so a new token can usually be
+# picked up from the existing session in a few seconds instead of a full login.
+BROWSER_KEEP_WARM = True
+# Restart the browser after this many refreshes or once it uses more memory than this
+BROWSER_MAX_USES = 20
+BROWSER_MAX_RSS_MB = 1024
+# How long the login waits for pages and the MFA prompt
+BROWSER_WAIT_SECONDS = 30
+# How long to wait for the bearer token once logged in, and for a manual login when headless is False
+BEARER_CAPTURE_SECONDS = 30
+MANUAL_LOGIN_SECONDS = 600
+
+# Base URLs of the upstream APIs. Only change these to point at a stand-in such as
+# bench/stub_server.py (see bench/README.md)
+TARGET_API_BASE_URL = "https://api.target.com"
+REDSKY_BASE_URL = "https://redsky.target.com"
+PUSHOVER_BASE_URL = "https://api.pushover.net"
+
+# Connect and read timeouts (seconds) for calls to Target's APIs
+UPSTREAM_CONNECT_TIMEOUT = 5
+UPSTREAM_READ_TIMEOUT = 20
+# Every upstream call (Target and Pushover) goes through one pooled client. 429 and 5xx answers
+# and connection failures are retried this many times with exponential backoff, honouring
+# Retry-After up to UPSTREAM_MAX_RETRY_AFTER_SECONDS.
+UPSTREAM_RETRIES = 3
+UPSTREAM_BACKOFF_SECONDS = 0.5
+UPSTREAM_MAX_BACKOFF_SECONDS = 10
+UPSTREAM_MAX_RETRY_AFTER_SECONDS = 30
+# Requests per second and burst allowed per upstream host, shared by the server workers and the
+# scripts through .ratelimit_<host>.json files in RATE_LIMIT_DIR. Requests over the limit queue
+# for up to RATE_LIMIT_WAIT_SECONDS before failing. Hosts not listed aren't limited.
+RATE_LIMITS = {"api.target.com": {"rate": 5, "burst": 20}}
+RATE_LIMIT_WAIT_SECONDS = 15
+RATE_LIMIT_DIR = "."
+# How many schedule weeks are fetched from upstream at the same time
+WEEK_FETCH_CONCURRENCY = 4
+
+# Stop calling the WFM, available shifts or store info API after this many consecutive failures
+# and probe it again after BREAKER_RESET_SECONDS. Meanwhile schedules are answered from the last copy fetched
+# within SCHEDULE_MAX_STALE_SECONDS, flagged with an X-Data-Stale header.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+# Instead of running top.py from cron, run its jobs on an interval from a long-running process
+# that keeps the token, browser, connection pools and caches warm: either `python scheduler.py`
+# or the server itself with SCHEDULER_IN_SERVER. Processes sharing this directory take turns, but
+# top.py doesn't check for them, so remove it from cron.
+SCHEDULER_IN_SERVER = False
+# Seconds between posted shift scans (needs run_posted_shifts) and schedule notifications; 0 turns one off
+SCHEDULER_POSTED_SHIFTS_SECONDS = 300
+SCHEDULER_SCHEDULE_SECONDS = 3600
+# Runs are spread by up to this fraction of their interval
+SCHEDULER_JITTER = 0.1
+
+# Every response carries a Server-Timing header with its stage breakdown (wall clock time per
+# stage, so stages can overlap but none exceeds total; for streamed responses only the work before
+# the body starts); requests slower than this (seconds) also get a structured "Slow request" log entry
+SLOW_REQUEST_SECONDS = 2.0
+
+# API keys (separate from the tenants' keys) allowed to scrape GET /metrics (send the key in the
+# X-API-Key header) and to call POST /debug/profile?seconds=10, which profiles the running server
+# and returns a cProfile and tracemalloc report
+ADMIN_API_KEYS = []
+PROFILE_MAX_SECONDS = 60
+# Also save each profile (.prof, .tracemalloc snapshot and .txt report) in this directory
+PROFILE_DIR = None
+PROFILE_TRACEMALLOC_FRAMES = 1
+
+# Logging. LOG_LEVELS overrides LOG_LEVEL per module, e.g. {"functions": "WARNING", "get_bearer": "DEBUG"}
+LOG_LEVEL = "INFO"
+LOG_LEVELS = {}
+# One JSON object per line, for log shippers
+LOG_JSON = False
+# Write logs from a background thread so requests don't wait on the terminal or disk
+LOG_ENQUEUE = True
+# Log file for the server (None logs to stderr only) and for top.py, rotated at LOG_ROTATION
+LOG_FILE = None
+SCRIPT_LOG_FILE = "script.log"
+LOG_ROTATION = "500 MB"
+# Write only 1 in this many cache hit messages
+LOG_SAMPLE_EVERY = 100
+# Log every SQL statement SQLAlchemy runs
+SQL_ECHO = False
+
+# Schedule and API response caches
+CACHE_TTL_SECONDS = 300
+# Least recently used entries are evicted past this many entries per cache
+CACHE_MAX_ENTRIES = 256
+# Optional byte budget per cache, counting each value's serialized (JSON) size. Parsed values
+# take a few times that in memory, so leave headroom
+CACHE_MAX_BYTES = None
+# Per-namespace TTL overrides by key prefix, e.g. {"schedule_": 600}
+CACHE_NAMESPACE_TTLS = {}
+# How often expired entries are swept in the background (None to only expire on read)
+CACHE_SWEEP_SECONDS = 60
+STORE_CACHE_TTL_SECONDS = 86400
+# Keep schedules and store info in shift_database.sqlite3 too, so restarts start
+# with warm caches and several uvicorn workers share one cache
+PERSISTENT_CACHE = False
+
+# Keep the current and next weeks' schedules warm from inside the server
+SCHEDULE_BACKGROUND_REFRESH = True
+SCHEDULE_WARM_WEEKS = 4
+# Refresh a week this many seconds before its cache entry expires
+SCHEDULE_REFRESH_AHEAD_SECONDS = 30
+SCHEDULE_REFRESH_CHECK_SECONDS = 15
+# Keep serving a schedule for up to this long if upstream is down: past its cache TTL, or since it
+# was fetched when it comes from the last good copies kept for outages. No schedule older is served.
+SCHEDULE_MAX_STALE_SECONDS = 3600
+# Longest range (in weeks) /schedule?start=&end= and the horizon parameters accept
+MAX_RANGE_WEEKS = 26
+# How many weeks /next_shift and /next_day_off look ahead unless ?horizon= is given
+NEXT_SHIFT_HORIZON_WEEKS = 2
+NEXT_DAY_OFF_HORIZON_WEEKS = 4
+
 get_schedule_headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36 Edg/126.0.0.0",
     "Upgrade-Insecure-Requests": "1",
@@ -1,7 +1,16 @@
-from sqlalchemy import create_engine, String, select
+import json
+
+from sqlalchemy import create_engine, inspect, text, String, Text, select, delete
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
 
-engine = create_engine("sqlite:///shift_database.sqlite3", echo=True)
+import config_file
+import tenants
+from file_lock import FileLock
+
+# Log every SQL statement; very noisy, for debugging only
+SQL_ECHO = getattr(config_file, "SQL_ECHO", False)
+
+engine = create_engine("sqlite:///shift_database.sqlite3", echo=SQL_ECHO)
 # Create engine for sqlite
 
 
@@ -10,10 +19,92 @@ class Base(DeclarativeBase):
 
 
 class SeenShift(Base):
+    # Posted shifts already notified, per employee so each of them hears about every shift
     __tablename__ = "seen_shifts"
+    employee_id: Mapped[int] = mapped_column(primary_key=True)
     id: Mapped[int] = mapped_column(primary_key=True)
 
 
+class CachedValue(Base):
+    # Persistent copy of cache entries so restarts and other workers start warm
+    __tablename__ = "cache_entries"
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    value: Mapped[str] = mapped_column(Text)
+    # Unix timestamps, so they mean the same thing in every process
+    stored_at: Mapped[float]
+    expires_at: Mapped[float]
+
+
+def _migrate_seen_shifts():
+    # seen_shifts used to be keyed by shift id alone, from when only one employee was served;
+    # those rows belong to the first tenant. Locked so workers starting together migrate it once.
+    with FileLock("shift_database.sqlite3.lock"):
+        db = inspect(engine)
+        if not db.has_table("seen_shifts"):
+            return
+        if "employee_id" in [column["name"] for column in db.get_columns("seen_shifts")]:
+            return
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE seen_shifts RENAME TO seen_shifts_old"))
+            SeenShift.__table__.create(conn)
+            conn.execute(
+                text("INSERT INTO seen_shifts (employee_id, id) SELECT :employee_id, id FROM seen_shifts_old"),
+                {"employee_id": tenants.default_tenant().employee_id},
+            )
+            conn.execute(text("DROP TABLE seen_shifts_old"))
+
+
+_migrate_seen_shifts()
 with Session(engine) as session:
     Base.metadata.create_all(engine)
     session.commit()
+
+
+class SQLiteCacheBackend:
+    """Stores a Cache's entries in the cache_entries table, serialized with dumps/loads."""
+
+    def __init__(self, namespace, dumps=json.dumps, loads=json.loads):
+        self._prefix = f"{namespace}:"
+        self._dumps = dumps
+        self._loads = loads
+
+    def load(self, key):
+        # Returns (value, stored_at, expires_at) or None
+        with Session(engine) as session:
+            row = session.get(CachedValue, self._prefix + key)
+            if row is None:
+                return None
+            return self._loads(row.value), row.stored_at, row.expires_at
+
+    def store(self, key, value, stored_at, expires_at):
+        with Session(engine) as session:
+            session.merge(
+                CachedValue(
+                    key=self._prefix + key,
+                    value=self._dumps(value),
+                    stored_at=stored_at,
+                    expires_at=expires_at,
+                )
+            )
+            session.commit()
+
+    def delete(self, key):
+        with Session(engine) as session:
+            session.execute(delete(CachedValue).where(CachedValue.key == self._prefix + key))
+            session.commit()
+
+    def purge(self, expired_before):
+        # Deletes this namespace's rows that expired before the given unix time
+        with Session(engine) as session:
+            session.execute(
+                delete(CachedValue).where(
+                    CachedValue.key.startswith(self._prefix, autoescape=True),
+                    CachedValue.expires_at < expired_before,
+                )
+            )
+            session.commit()
+
+    def clear(self, prefix=""):
+        with Session(engine) as session:
+            session.execute(delete(CachedValue).where(CachedValue.key.startswith(self._prefix + prefix, autoescape=True)))
+            session.commit()
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between processes (e.g. uvicorn workers and cron scripts)."""
+
+    def __init__(self, path: str, timeout: Optional[float] = None, poll_interval: float = 0.1):
+        self._path = path
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._fd = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        timeout = self._timeout if timeout is None else timeout
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._try_lock():
+            if deadline is not None and time.monotonic() >= deadline:
+                os.close(self._fd)
+                self._fd = None
+                raise LockTimeout(f"Timed out waiting for {self._path}")
+            time.sleep(self._poll_interval)
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def atomic_write(path: str, data: str) -> None:
+    """Writes a file through a temp file and a rename so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
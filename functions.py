@@ -1,15 +1,26 @@
 import os
-import requests
+import json
+import dataclasses
 import datetime
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from db import engine, SeenShift
+from db import engine, SeenShift, SQLiteCacheBackend
 
 from loguru import logger
 
 import config_file
-from cache import Cache
+import log_config
+import metrics
+import models
+import tenants
+import timing
+import upstream
+from cache import Cache, SingleFlight
+from circuit_breaker import CircuitBreaker
+from rate_limiter import RateLimited
 
 logger.info("Changing cwd to file path")
 os.chdir(os.path.dirname(__file__))
@@ -17,11 +28,93 @@ os.chdir(os.path.dirname(__file__))
 creds = None
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# Cache settings, see config_template.py
+CACHE_TTL_SECONDS = getattr(config_file, "CACHE_TTL_SECONDS", 300)
+CACHE_MAX_ENTRIES = getattr(config_file, "CACHE_MAX_ENTRIES", 256)
+CACHE_MAX_BYTES = getattr(config_file, "CACHE_MAX_BYTES", None)
+CACHE_NAMESPACE_TTLS = getattr(config_file, "CACHE_NAMESPACE_TTLS", {})
+CACHE_SWEEP_SECONDS = getattr(config_file, "CACHE_SWEEP_SECONDS", 60)
+STORE_CACHE_TTL_SECONDS = getattr(config_file, "STORE_CACHE_TTL_SECONDS", 86400)
+# Upstream base URLs, overridable to point at a stand-in such as bench/stub_server.py
+TARGET_API_BASE_URL = getattr(config_file, "TARGET_API_BASE_URL", "https://api.target.com")
+REDSKY_BASE_URL = getattr(config_file, "REDSKY_BASE_URL", "https://redsky.target.com")
+PUSHOVER_BASE_URL = getattr(config_file, "PUSHOVER_BASE_URL", "https://api.pushover.net")
+# Keep a copy of schedules and store info in shift_database.sqlite3
+PERSISTENT_CACHE = getattr(config_file, "PERSISTENT_CACHE", False)
+# How long past its TTL a schedule may still be served while upstream can't be reached. Also caps
+# the age of the last good copy of a week served while the WFM API is down.
+SCHEDULE_MAX_STALE_SECONDS = getattr(config_file, "SCHEDULE_MAX_STALE_SECONDS", 3600)
+# Stop calling an endpoint after this many consecutive failures, and probe it again after BREAKER_RESET_SECONDS
+BREAKER_FAILURE_THRESHOLD = getattr(config_file, "BREAKER_FAILURE_THRESHOLD", 5)
+BREAKER_RESET_SECONDS = getattr(config_file, "BREAKER_RESET_SECONDS", 30)
+
+
+def new_cache(name, ttl_seconds=CACHE_TTL_SECONDS, max_stale_seconds=0, persist=None, dumps=None):
+    # persist is a (dumps, loads) pair used when PERSISTENT_CACHE is on. CACHE_MAX_BYTES counts each
+    # value's serialized size, from dumps or persist's; sys.getsizeof would only see the outer object.
+    backend = None
+    if PERSISTENT_CACHE and persist is not None:
+        backend = SQLiteCacheBackend(name, *persist)
+    dumps = dumps or (persist[0] if persist is not None else json.dumps)
+    cache = Cache(
+        ttl_seconds=ttl_seconds,
+        max_entries=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        size_fn=lambda value: len(dumps(value)),
+        namespace_ttls=CACHE_NAMESPACE_TTLS,
+        sweep_interval=CACHE_SWEEP_SECONDS,
+        name=name,
+        max_stale_seconds=max_stale_seconds,
+        backend=backend,
+    )
+    metrics.register_cache(cache)
+    return cache
+
+
+# Serializers for caches holding plain JSON payloads or models.Week
+JSON_PERSIST = (json.dumps, json.loads)
+WEEK_PERSIST = (
+    lambda week: json.dumps(week.to_dict()),
+    lambda value: models.Week.from_dict(json.loads(value)),
+)
+
 # Add store cache
-_store_cache = {}
+_store_cache = new_cache(
+    "store",
+    ttl_seconds=STORE_CACHE_TTL_SECONDS,
+    persist=(lambda s: json.dumps(s.to_dict()), lambda v: Store.from_dict(json.loads(v))),
+)
 # Add API response caches with 5 minute TTL
-_wfm_cache = Cache(ttl_seconds=300)
-_available_shifts_cache = Cache(ttl_seconds=300)
+_wfm_cache = new_cache("wfm", dumps=WEEK_PERSIST[0])
+_available_shifts_cache = new_cache(
+    "available_shifts", dumps=lambda shifts: json.dumps([dataclasses.astuple(s) for s in shifts], default=str)
+)
+# Concurrent misses for the same week share a single upstream call
+_wfm_flight = SingleFlight()
+_available_shifts_flight = SingleFlight()
+# Last successful answer for every week, served when the WFM API can't be reached
+_last_good_weeks = new_cache("last_good_wfm", ttl_seconds=SCHEDULE_MAX_STALE_SECONDS, persist=WEEK_PERSIST)
+# Weekly schedules as served by server.py and get_schedule.py, keyed schedule_{employee_id}_{start}_{end}
+schedule_cache = new_cache("schedule", max_stale_seconds=SCHEDULE_MAX_STALE_SECONDS, persist=WEEK_PERSIST)
+_wfm_breaker = CircuitBreaker("wfm", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_available_shifts_breaker = CircuitBreaker("available_shifts", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+_store_breaker = CircuitBreaker("store_info", BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+
+# How many weeks are fetched from upstream at the same time
+WEEK_FETCH_CONCURRENCY = getattr(config_file, "WEEK_FETCH_CONCURRENCY", 4)
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, detail=""):
+        super().__init__(f"API returned {status_code}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class CircuitOpenError(UpstreamError):
+    # Raised without calling upstream while an endpoint's circuit breaker is open
+    def __init__(self, name):
+        super().__init__(503, f"{name} circuit open")
 
 
 class Store:
@@ -30,20 +123,41 @@ class Store:
         self.timezone_offset = "00:00:00"
         self.store_id = "0000"
 
-
-def notify_user(message):
-    if config_file.PUSHOVER_APP_API_KEY == "" or config_file.PUSHOVER_USER_API_KEY == "":
-        logger.info("Config file for pushover is empty, ignoring")
+    def to_dict(self):
+        return {
+            "address": self.address,
+            "timezone_offset": self.timezone_offset,
+            "store_id": self.store_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        s = cls()
+        s.address = data["address"]
+        s.timezone_offset = data["timezone_offset"]
+        s.store_id = data["store_id"]
+        return s
+
+
+def notify_user(message, tenant=None):
+    # Sent to the tenant's own Pushover user key; tenant defaults to the employee the scripts run for
+    tenant = tenant or tenants.default_tenant()
+    if config_file.PUSHOVER_APP_API_KEY == "" or tenant.pushover_user_key == "":
+        logger.info(f"No pushover keys configured for {tenant.name}, ignoring")
+        return
+    logger.info(f"Notifying {tenant.name} via Pushover...")
+    try:
+        r = upstream.post(
+            f"{PUSHOVER_BASE_URL}/1/messages.json",
+            data={
+                "token": config_file.PUSHOVER_APP_API_KEY,
+                "user": tenant.pushover_user_key,
+                "message": message,
+            },
+        )
+    except (httpx.HTTPError, RateLimited) as e:
+        logger.error(f"Notifying FAILED {str(e)}")
         return
-    logger.info("Notifying User via Pushover...")
-    r = requests.post(
-        "https://api.pushover.net/1/messages.json",
-        data={
-            "token": config_file.PUSHOVER_APP_API_KEY,
-            "user": config_file.PUSHOVER_USER_API_KEY,
-            "message": message,
-        },
-    )
     # try to notify the user, if it fails then log
     try:
         r.raise_for_status()
@@ -94,24 +208,47 @@ def get_current_timezone_offset():
     return offset
 
 
-def get_store_info(store_id):
-    # Check cache first
-    if store_id in _store_cache:
-        logger.success(f"Cache hit for store info {store_id}")
-        return _store_cache[store_id]
-        
-    logger.warning(f"Cache miss for store info {store_id}, fetching from API")
-    # Get store address and TimeZone offset
-    r = requests.get(
-        "https://redsky.target.com/redsky_aggregations/v1/web/store_location_v1"
+def get_upcoming_weeks(count=4):
+    # Sunday to Saturday date pairs, starting with the current week
+    start_week_obj = datetime.datetime.now()
+    # weekday() is 0 on Mondays, so Sunday is (weekday() + 1) % 7 days back, or today on Sundays
+    start_week_obj -= datetime.timedelta((start_week_obj.weekday() + 1) % 7)
+    return [
+        (
+            (start_week_obj + datetime.timedelta(weeks=i)).date(),
+            (start_week_obj + datetime.timedelta(weeks=i, days=6)).date(),
+        )
+        for i in range(count)
+    ]
+
+
+def fetch_weeks(fetch, weeks, max_workers=WEEK_FETCH_CONCURRENCY):
+    # Calls fetch(start_date, end_date) for every week concurrently.
+    # Results come back in week order, with None for any week that failed.
+    def fetch_one(week):
+        try:
+            return fetch(*week)
+        except Exception as e:
+            logger.error(f"Fetching week {week[0]} failed: {str(e)}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fetch_one, weeks))
+
+
+def _store_url(store_id):
+    return (
+        f"{REDSKY_BASE_URL}/redsky_aggregations/v1/web/store_location_v1"
         f"?store_id={store_id}"
-        f"&key={config_file.API_KEY}",
-        headers=config_file.get_schedule_headers,
+        f"&key={config_file.API_KEY}"
     )
+
+
+def _parse_store(store_id, store_response):
     s = Store()
     # Initialize store object
 
-    store_json = r.json()["data"]["store"]["mailing_address"]
+    store_json = store_response["data"]["store"]["mailing_address"]
     # create object to reduce lines of code.
     s.address = (
         f"{store_json['address_line1']} {store_json['city']}, "
@@ -119,111 +256,284 @@ def get_store_info(store_id):
     )
     s.timezone_offset = get_current_timezone_offset()
     s.store_id = store_id
-    
+    return s
+
+
+def get_store_info(store_id):
+    # Check cache first
+    cached_store = _store_cache.get(store_id)
+    if cached_store is not None:
+        log_config.sampled("store_cache_hit").success(f"Cache hit for store info {store_id}")
+        return cached_store
+        
+    logger.warning(f"Cache miss for store info {store_id}, fetching from API")
+    # Get store address and TimeZone offset, raises UpstreamError if redsky doesn't answer 200
+    r = _guarded_get(_store_breaker, _store_url(store_id), config_file.get_schedule_headers)
+    s = _parse_store(store_id, r.json())
     # Cache the store info
-    _store_cache[store_id] = s
+    _store_cache.set(store_id, s)
     return s
 
 
+async def get_store_info_async(store_id):
+    cached_store = await _store_cache.get_async(store_id)
+    if cached_store is not None:
+        log_config.sampled("store_cache_hit").success(f"Cache hit for store info {store_id}")
+        return cached_store
+
+    logger.warning(f"Cache miss for store info {store_id}, fetching from API")
+    r = await _guarded_get_async(_store_breaker, _store_url(store_id), config_file.get_schedule_headers)
+    s = _parse_store(store_id, r.json())
+    await _store_cache.set_async(store_id, s)
+    return s
+
+
+def _wfm_url(tenant, start_date, end_date):
+    return (
+        f"{TARGET_API_BASE_URL}/wfm_schedules/v1/weekly_schedules?"
+        f"team_member_number=00{tenant.employee_id}"
+        f"&start_date={start_date}"
+        f"&end_date={end_date}"
+        f"&location_id="  # Needs this flag for some reason.
+        f"&key={config_file.API_KEY}"
+    )
+
+
+def _available_shifts_url(tenant, start_date, end_date):
+    return (
+        f"{TARGET_API_BASE_URL}/wfm_available_shifts/v1/available_shifts?"
+        f"worker_id={tenant.employee_id}"
+        f"&start_date={start_date}"
+        f"&end_date={end_date}"
+        f"&location_ids={tenant.store_number}"  # Needs this flag for some reason.
+        f"&key={config_file.API_KEY}"
+    )
+
+
+def _check_response(r):
+    if r.status_code != 200:
+        raise UpstreamError(r.status_code, r.text)
+    return r
+
+
+def _is_outage(r):
+    # Answers that say upstream is struggling, as opposed to e.g. a 401 for a stale token
+    return r.status_code == 429 or r.status_code >= 500
+
+
+def _guarded_get(breaker, url, hdr):
+    # upstream.get through the endpoint's circuit breaker, raising UpstreamError on a non-200
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.name)
+    try:
+        with timing.span(breaker.name):
+            r = upstream.get(url, headers=hdr)
+    except RateLimited as e:
+        # Our own limiter said no, upstream itself is fine
+        raise UpstreamError(503, str(e)) from e
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        # No answer at all counts as a gateway timeout
+        raise UpstreamError(504, str(e)) from e
+    if _is_outage(r):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return _check_response(r)
+
+
+async def _guarded_get_async(breaker, url, hdr):
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.name)
+    try:
+        with timing.span(breaker.name):
+            r = await upstream.get_async(url, headers=hdr)
+    except RateLimited as e:
+        raise UpstreamError(503, str(e)) from e
+    except httpx.HTTPError as e:
+        breaker.record_failure()
+        raise UpstreamError(504, str(e)) from e
+    if _is_outage(r):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return _check_response(r)
+
+
+def _within_stale_limit(entry):
+    # The cache TTL already drops older copies, but a CACHE_NAMESPACE_TTLS entry for "wfm_" would override it
+    if entry is None or entry.age > SCHEDULE_MAX_STALE_SECONDS:
+        return None
+    return entry
+
+
+def get_last_good_week(start_date, end_date, tenant=None):
+    """Returns the CacheEntry of the last week call_wfm fetched successfully for these dates,
+    if any was fetched within SCHEDULE_MAX_STALE_SECONDS."""
+    tenant = tenant or tenants.default_tenant()
+    return _within_stale_limit(_last_good_weeks.get_entry(f"wfm_{tenant.employee_id}_{start_date}_{end_date}"))
+
+
+async def get_last_good_week_async(start_date, end_date, tenant=None):
+    tenant = tenant or tenants.default_tenant()
+    entry = await _last_good_weeks.get_entry_async(f"wfm_{tenant.employee_id}_{start_date}_{end_date}")
+    return _within_stale_limit(entry)
+
+
+def _keep_unchanged(week, previous):
+    # Upstream mostly sends back the same week; keep the Week we already have so its index isn't rebuilt
+    if previous is not None and previous.value.days == week.days:
+        return previous.value
+    return week
+
+
 def call_wfm(
     hdr,
     start_date,
     end_date,
+    tenant=None,
 ):
-    # Function to call and retrieve schedule.
+    # Function to call and retrieve schedule, parsed into a models.Week.
     # Start Date and end date format should be YYYY-MM-DD
-    cache_key = f"wfm_{start_date}_{end_date}"
+    # Raises UpstreamError if the API doesn't answer 200.
+    # tenant defaults to the employee the scripts run for.
+    tenant = tenant or tenants.default_tenant()
+    cache_key = f"wfm_{tenant.employee_id}_{start_date}_{end_date}"
     
     # Check cache first
-    cached_response = _wfm_cache.get(cache_key)
-    if cached_response is not None:
-        logger.success(f"Cache hit for WFM data {cache_key}")
-        return cached_response
-
-    logger.warning(f"Cache miss for WFM data {cache_key}, fetching from API")
-    r = requests.get(
-        f"https://api.target.com/wfm_schedules/v1/weekly_schedules?"
-        f"team_member_number=00{config_file.EMPLOYEE_ID}"
-        f"&start_date={start_date}"
-        f"&end_date={end_date}"
-        f"&location_id="  # Needs this flag for some reason.
-        f"&key={config_file.API_KEY}",
-        headers=hdr,
-    )
-    
-    # Cache the response if successful
-    if r.status_code == 200:
-        _wfm_cache.set(cache_key, r)
-        
-    return r
+    cached_week = _wfm_cache.get(cache_key)
+    if cached_week is not None:
+        log_config.sampled("wfm_cache_hit").success(f"Cache hit for WFM data {cache_key}")
+        return cached_week
+
+    def fetch():
+        logger.warning(f"Cache miss for WFM data {cache_key}, fetching from API")
+        r = _guarded_get(_wfm_breaker, _wfm_url(tenant, start_date, end_date), hdr)
+        with timing.span("wfm_parse"):
+            week = models.parse_week(r.json())
+        week = _keep_unchanged(week, _last_good_weeks.get_entry(cache_key))
+        _wfm_cache.set(cache_key, week)
+        _last_good_weeks.set(cache_key, week)
+        return week
+
+    return _wfm_flight.do(cache_key, fetch)
+
+
+async def call_wfm_async(hdr, start_date, end_date, refresh=False, tenant=None):
+    # Same as call_wfm, but on the shared async client so the event loop is never blocked.
+    # refresh skips the cache lookup so the data comes straight from upstream.
+    tenant = tenant or tenants.default_tenant()
+    cache_key = f"wfm_{tenant.employee_id}_{start_date}_{end_date}"
+
+    cached_week = None if refresh else await _wfm_cache.get_async(cache_key)
+    if cached_week is not None:
+        log_config.sampled("wfm_cache_hit").success(f"Cache hit for WFM data {cache_key}")
+        return cached_week
+
+    async def fetch():
+        logger.warning(f"Cache miss for WFM data {cache_key}, fetching from API")
+        r = await _guarded_get_async(_wfm_breaker, _wfm_url(tenant, start_date, end_date), hdr)
+        with timing.span("wfm_parse"):
+            week = models.parse_week(r.json())
+        week = _keep_unchanged(week, await _last_good_weeks.get_entry_async(cache_key))
+        await _wfm_cache.set_async(cache_key, week)
+        await _last_good_weeks.set_async(cache_key, week)
+        return week
+
+    return await _wfm_flight.do_async(cache_key, fetch)
 
 
 def call_available_shifts(
     hdr,
     start_date,
     end_date,
+    tenant=None,
 ):
-    cache_key = f"available_shifts_{start_date}_{end_date}"
+    # Returns a tuple of models.AvailableShift, raises UpstreamError on a non-200
+    tenant = tenant or tenants.default_tenant()
+    cache_key = f"available_shifts_{tenant.employee_id}_{start_date}_{end_date}"
     
     # Check cache first
-    cached_response = _available_shifts_cache.get(cache_key)
-    if cached_response is not None:
-        logger.success(f"Cache hit for available shifts {cache_key}")
-        return cached_response
-
-    logger.warning(f"Cache miss for available shifts {cache_key}, fetching from API")
-    r = requests.get(
-        f"https://api.target.com/wfm_available_shifts/v1/available_shifts?"
-        f"worker_id={config_file.EMPLOYEE_ID}"
-        f"&start_date={start_date}"
-        f"&end_date={end_date}"
-        f"&location_ids={config_file.STORE_NUMBER}"  # Needs this flag for some reason.
-        f"&key={config_file.API_KEY}",
-        headers=hdr,
-    )
+    cached_shifts = _available_shifts_cache.get(cache_key)
+    if cached_shifts is not None:
+        log_config.sampled("available_shifts_cache_hit").success(f"Cache hit for available shifts {cache_key}")
+        return cached_shifts
+
+    def fetch():
+        logger.warning(f"Cache miss for available shifts {cache_key}, fetching from API")
+        r = _guarded_get(_available_shifts_breaker, _available_shifts_url(tenant, start_date, end_date), hdr)
+        with timing.span("available_shifts_parse"):
+            shifts = models.parse_available_shifts(r.json())
+        _available_shifts_cache.set(cache_key, shifts)
+        return shifts
+
+    return _available_shifts_flight.do(cache_key, fetch)
+
+
+async def call_available_shifts_async(hdr, start_date, end_date, tenant=None):
+    tenant = tenant or tenants.default_tenant()
+    cache_key = f"available_shifts_{tenant.employee_id}_{start_date}_{end_date}"
+
+    cached_shifts = await _available_shifts_cache.get_async(cache_key)
+    if cached_shifts is not None:
+        log_config.sampled("available_shifts_cache_hit").success(f"Cache hit for available shifts {cache_key}")
+        return cached_shifts
+
+    async def fetch():
+        logger.warning(f"Cache miss for available shifts {cache_key}, fetching from API")
+        r = await _guarded_get_async(
+            _available_shifts_breaker, _available_shifts_url(tenant, start_date, end_date), hdr
+        )
+        with timing.span("available_shifts_parse"):
+            shifts = models.parse_available_shifts(r.json())
+        await _available_shifts_cache.set_async(cache_key, shifts)
+        return shifts
 
-    # Cache the response if successful
-    if r.status_code == 200:
-        _available_shifts_cache.set(cache_key, r)
+    return await _available_shifts_flight.do_async(cache_key, fetch)
 
-    return r
 
-
-def test_token(test_header):
+def test_token(test_header, tenant=None):
     # Function to test if Bearer token is valid
-    test_request = requests.get(
-        f"https://api.target.com/wfm_schedules/v1/weekly_schedules?"
-        f"team_member_number=00{config_file.EMPLOYEE_ID}"
-        "&start_date=2020-06-23"
-        "&end_date=2020-06-29"  # any date should work here, we're just making sure the key is valid
-        "&location_id="  # Needs this flag for some reason.
-        f"&key={config_file.API_KEY}",
-        headers=test_header,
-    )
+    # any date should work here, we're just making sure the key is valid
+    tenant = tenant or tenants.default_tenant()
+    with timing.span("test_token"):
+        test_request = upstream.get(_wfm_url(tenant, "2020-06-23", "2020-06-29"), headers=test_header)
     return test_request
 
 
-def seen_or_record(shift):
-    with Session(engine) as session:
-        logger.info(f"Checking if shift {shift['available_shift_id']} exists")
+async def test_token_async(test_header, tenant=None):
+    tenant = tenant or tenants.default_tenant()
+    with timing.span("test_token"):
+        return await upstream.get_async(_wfm_url(tenant, "2020-06-23", "2020-06-29"), headers=test_header)
+
+
+def seen_or_record(shift, tenant=None):
+    # shift is a models.AvailableShift; it is recorded and notified once per tenant
+    tenant = tenant or tenants.default_tenant()
+    with (
+        timing.span("seen_or_record"),
+        metrics.timed(metrics.sqlite_duration, "seen_or_record"),
+        Session(engine) as session,
+    ):
+        logger.info(f"Checking if shift {shift.available_shift_id} exists")
         result = session.scalar(
-            select(SeenShift).filter(SeenShift.id == shift["available_shift_id"])
+            select(SeenShift).filter(
+                SeenShift.employee_id == tenant.employee_id, SeenShift.id == shift.available_shift_id
+            )
         )
 
         if result:
             logger.info("Shift found, exiting function")
             return
         logger.info("Shift not found, adding to database")
-        new_shift = SeenShift(id=shift["available_shift_id"])
+        new_shift = SeenShift(employee_id=tenant.employee_id, id=shift.available_shift_id)
         session.add(new_shift)
         session.commit()
 
-        dt_start = datetime.datetime.fromisoformat(shift["shift_start"])
-        dt_end = datetime.datetime.fromisoformat(shift["shift_end"])
-
-        notify_user(
-            f"A new {shift['shift_hours']} hour shift has been posted for {dt_start.date()} "
-            f"from {dt_start.strftime('%I:%M %p')} "
-            f"to {dt_end.strftime('%I:%M %p')} for "
-            f"{shift['org_structure']['job']}"
-        )
+    notify_user(
+        f"A new {shift.shift_hours} hour shift has been posted for {shift.start.date()} "
+        f"from {shift.start.strftime('%I:%M %p')} "
+        f"to {shift.end.strftime('%I:%M %p')} for "
+        f"{shift.job}",
+        tenant,
+    )
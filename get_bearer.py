@@ -1,130 +1,380 @@
-def get_token():
-    import json
-    import time
-    import config_file
-    from loguru import logger
-    import undetected_chromedriver as uc
-    from selenium.common.exceptions import TimeoutException
-    from selenium.webdriver.common.by import By
-    from selenium.webdriver.common.keys import Keys
-    from selenium.webdriver.support import expected_conditions as ec
-    from selenium.webdriver.support.ui import WebDriverWait
-    from selenium.webdriver.chrome.service import Service
-
-    logger.info("Setting up Chrome Options")
-    # Chrome Options
-    options = uc.ChromeOptions()
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True})
-    service = Service()
-    options.add_argument("--incognito")
-    options.headless = config_file.headless
-    # NEEDED FOR HEADLESS
-    options.add_argument("--enable-automation")
-    # Needed for Linux VM Headless
-    options.add_argument("--disable-gpu")
-    # Needed for Linux VM.
-    options.add_argument("--disable-software-rasterizer")
-
-    # options.add_argument("--no-sandbox")
-    # options.add_argument("--disable-dev-shm-usage")
-    # options.add_argument("--incognito")
-    # options.add_argument("--disable-extensions")
-    # options.add_argument("--disable-browser-side-navigation")
-    # options.add_argument("--disable-web-security")
-    # options.add_argument("--disable-dev-shm-usage")
-    # options.add_argument("--disable-infobars")
-    # options.add_argument("--disable-setuid-sandbox")
-
-    # logger.success("Arguments setup! Starting ChromeDriver")
-    browser = uc.Chrome(use_subprocess=True, options=options, service=service)
-    logger.success("ChromeDriver Setup! Starting")
-
-    # navigate to a website
-    logger.info("Launching myTime")
-    browser.get("http://mytime.target.com")
-    try:
-        element_present = ec.presence_of_element_located((By.ID, "loginID"))
-        WebDriverWait(browser, 10).until(element_present)
-        time.sleep(1)
-    except TimeoutException:
-        print("Timed out waiting for Login Page to load")
-        browser.close()
-
-    logger.info("entering username and password...")
-    username = browser.find_element(By.ID, "loginID")
-    password = browser.find_element(By.ID, "password")
-    # This finds the login and the password box
-    logger.info("Entering Username")
-    username.click()
-    username.send_keys(config_file.EMPLOYEE_ID)
-    username.send_keys(Keys.TAB)
-
-    logger.info("Entering Password")
-    username.click()
-    password.send_keys(config_file.PASSWORD)
-    password.click()
-
-    logger.info("Pressing Submit")
-    login_button = browser.find_element(By.ID, "submit-button")
-    login_button.submit()
-    time.sleep(2)
-
-    try:
-        mfa_button = browser.find_element(
-            By.XPATH, '//*[contains(text(), "Authenticator")]'
+import atexit
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from loguru import logger
+
+import config_file
+import metrics
+import tenants
+import timing
+
+# Keep the logged in browser open between refreshes so the next token can be re-harvested from the session
+BROWSER_KEEP_WARM = getattr(config_file, "BROWSER_KEEP_WARM", True)
+# Restart the browser after this many token refreshes, or once it uses more than BROWSER_MAX_RSS_MB
+BROWSER_MAX_USES = getattr(config_file, "BROWSER_MAX_USES", 20)
+BROWSER_MAX_RSS_MB = getattr(config_file, "BROWSER_MAX_RSS_MB", 1024)
+# How long to wait for a page or the MFA prompt
+BROWSER_WAIT_SECONDS = getattr(config_file, "BROWSER_WAIT_SECONDS", 30)
+# Overall deadline for the bearer to show up once logged in, and for a manual login in non headless mode
+BEARER_CAPTURE_SECONDS = getattr(config_file, "BEARER_CAPTURE_SECONDS", 30)
+MANUAL_LOGIN_SECONDS = getattr(config_file, "MANUAL_LOGIN_SECONDS", 600)
+
+MYTIME_URL = "https://mytime.target.com"
+# Only requests to this host carry the bearer we're after
+API_HOST = "api.target.com"
+
+
+def _process_tree_rss(pid):
+    # Resident memory in bytes of a process and all of its children, None where /proc isn't available
+    if not os.path.isdir("/proc"):
+        return None
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(children.get(current, []))
+    return total
+
+
+class BrowserWorker:
+    """A Chrome session for one tenant that stays open between token refreshes."""
+
+    def __init__(self, tenant, max_uses=BROWSER_MAX_USES, max_rss_mb=BROWSER_MAX_RSS_MB):
+        self.tenant = tenant
+        self._max_uses = max_uses
+        self._max_rss_mb = max_rss_mb
+        self._browser = None
+        self._uses = 0
+        self._lock = threading.Lock()
+        # Thread holding the DevTools connection, and a callable that ends it
+        self._listener = None
+        self._stop_listener = None
+        # Set by _on_request on any request to API_HOST, to tell a listener that hears nothing apart
+        self._api_request_seen = threading.Event()
+        # Filled in by _on_request as soon as the app sends an authorized API call
+        self._bearer = None
+        self._bearer_seen = threading.Event()
+        self._stale_bearer = None
+
+    def _start(self):
+        import undetected_chromedriver as uc
+        from selenium.webdriver.chrome.service import Service
+
+        logger.info("Setting up Chrome Options")
+        # Chrome Options
+        options = uc.ChromeOptions()
+        service = Service()
+        options.add_argument("--incognito")
+        options.headless = config_file.headless
+        # NEEDED FOR HEADLESS
+        options.add_argument("--enable-automation")
+        # Needed for Linux VM Headless
+        options.add_argument("--disable-gpu")
+        # Needed for Linux VM.
+        options.add_argument("--disable-software-rasterizer")
+
+        # options.add_argument("--no-sandbox")
+        # options.add_argument("--disable-dev-shm-usage")
+        # options.add_argument("--disable-extensions")
+        # options.add_argument("--disable-browser-side-navigation")
+        # options.add_argument("--disable-web-security")
+        # options.add_argument("--disable-infobars")
+        # options.add_argument("--disable-setuid-sandbox")
+
+        self._browser = uc.Chrome(use_subprocess=True, options=options, service=service)
+        self._uses = 0
+        self._start_listener()
+        logger.success("ChromeDriver Setup! Starting")
+
+    def _start_listener(self):
+        # Network events are pushed to us over a DevTools websocket as the page sends each request,
+        # rather than read back out of the performance log, so nothing polls for them
+        debugger_address = self._browser.capabilities["goog:chromeOptions"]["debuggerAddress"]
+        browser_info = httpx.get(f"http://{debugger_address}/json/version", timeout=BROWSER_WAIT_SECONDS).json()
+        version = re.search(r"/(\d+)\.", browser_info["Browser"]).group(1)
+        # chromedriver's window handles are DevTools target ids, so this is the tab we drive
+        page = self._browser.current_window_handle
+
+        started = threading.Event()
+        self._listener = threading.Thread(
+            target=self._listen,
+            args=(browser_info["webSocketDebuggerUrl"], version, page, started),
+            name="bearer-listener",
+            daemon=True,
         )
-        mfa_button.click()
-
-        element_present = ec.presence_of_element_located((By.ID, "totp-code"))
-        WebDriverWait(browser, 10).until(element_present)
-        time.sleep(1)
-
-        logger.success("Account Valid! Logging into 2FA")
-        otp = browser.find_element(By.ID, "totp-code")
-        otp.click()
-        otp.send_keys(config_file.get_mfa_code())
-
-        browser.find_element(By.ID, "submit-button").click()
-        logger.info("Clicking submit...")
-        time.sleep(10)
-    except Exception as e:
-        if config_file.headless:
-            logger.error(f"Auto-login failed in headless mode: {str(e)}")
-            browser.quit()
+        self._listener.start()
+        started.wait(BROWSER_WAIT_SECONDS)
+        if self._stop_listener is None:
+            raise Exception("Couldn't subscribe to the browser's network events")
+
+    def _listen(self, ws_url, version, page, started):
+        import trio
+
+        try:
+            trio.run(self._listen_async, ws_url, version, page, started)
+        except Exception as e:
+            # Also how the listener ends when the browser quits underneath it
+            logger.debug(f"Bearer listener stopped: {str(e)}")
+        finally:
+            self._stop_listener = None
+            started.set()
+
+    async def _listen_async(self, ws_url, version, page, started):
+        import trio
+        from selenium.webdriver.common.bidi import cdp
+
+        devtools = cdp.import_devtools(version)
+        async with cdp.open_cdp(ws_url) as connection:
+            # Attach to our tab itself; the first target Chrome lists (what bidi_connection() picks)
+            # can be a service worker or another page, whose requests aren't the ones we need
+            targets = await connection.execute(devtools.target.get_targets())
+            pages = [target.target_id for target in targets if target.type_ == "page"]
+            if page not in pages:
+                logger.warning(f"Tab {page} isn't among the browser's DevTools targets, listening to {pages[0]}")
+                page = pages[0]
+            async with connection.open_session(devtools.target.TargetID(page)) as session:
+                await session.execute(devtools.network.enable())
+                events = session.listen(devtools.network.RequestWillBeSent, buffer_size=100)
+                with trio.CancelScope() as scope:
+                    token = trio.lowlevel.current_trio_token()
+                    self._stop_listener = lambda: token.run_sync_soon(scope.cancel)
+                    started.set()
+                    async for event in events:
+                        self._on_request(event.request.url, event.request.headers)
+
+    def close(self):
+        if self._browser is None:
+            return
+        stop = self._stop_listener
+        if stop is not None:
+            try:
+                stop()
+            except Exception:
+                # The listener's trio loop already finished
+                pass
+        try:
+            self._browser.quit()
+        except Exception as e:
+            logger.warning(f"Closing browser failed: {str(e)}")
+        if self._listener is not None:
+            self._listener.join(BROWSER_WAIT_SECONDS)
+            self._listener = None
+        self._browser = None
+
+    def _needs_recycle(self):
+        if self._uses >= self._max_uses:
+            logger.info(f"Browser used {self._uses} times, restarting it")
+            return True
+        rss = _process_tree_rss(getattr(self._browser, "browser_pid", None) or 0)
+        if rss is not None and rss > self._max_rss_mb * 1024 * 1024:
+            logger.info(f"Browser using {rss // (1024 * 1024)} MB, restarting it")
+            return True
+        return False
+
+    def _wait(self, condition, timeout=BROWSER_WAIT_SECONDS):
+        # Returns condition's first truthy result, or None once timeout runs out
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        try:
+            return WebDriverWait(self._browser, timeout, poll_frequency=0.2).until(lambda b: condition())
+        except TimeoutException:
             return None
-        else:
+
+    def _on_request(self, url, headers):
+        # Runs on the listener thread for every request the page sends (Network.requestWillBeSent)
+        if urlsplit(url).hostname != API_HOST:
+            return
+        self._api_request_seen.set()
+        auth_header = headers.get("Authorization", headers.get("authorization", ""))
+        if auth_header.startswith("Bearer ") and auth_header != self._stale_bearer:
+            self._bearer = auth_header
+            self._bearer_seen.set()
+
+    def _expect_bearer(self, stale_bearer):
+        # Forget the previous capture; a request carrying stale_bearer doesn't count
+        self._stale_bearer = stale_bearer
+        self._bearer = None
+        self._bearer_seen.clear()
+        self._api_request_seen.clear()
+
+    def _wait_for_bearer(self, timeout):
+        self._bearer_seen.wait(timeout)
+        return self._bearer
+
+    def _present(self, by, value):
+        elements = self._browser.find_elements(by, value)
+        return elements[0] if elements else None
+
+    def get_token(self, stale_bearer=None):
+        """Returns a fresh bearer token, from the open session if it is still logged in."""
+        with self._lock:
+            if self._browser is not None and self._needs_recycle():
+                self.close()
+
+            warm = self._browser is not None
+            try:
+                if not warm:
+                    with timing.span("browser_start"):
+                        self._start()
+                self._uses += 1
+                with timing.span("browser_login"):
+                    token = self._harvest(stale_bearer)
+                if token is None and warm:
+                    # The old session is no good any more, log in again from a clean browser
+                    logger.warning("Warm browser session didn't produce a token, restarting it")
+                    self.close()
+                    with timing.span("browser_start"):
+                        self._start()
+                    with timing.span("browser_login"):
+                        token = self._harvest(stale_bearer)
+            except Exception as e:
+                logger.error(f"Browser login failed: {str(e)}")
+                self.close()
+                return None
+
+            if token is None or not BROWSER_KEEP_WARM:
+                self.close()
+            return token
+
+    def _harvest(self, stale_bearer):
+        from selenium.webdriver.common.by import By
+
+        self._expect_bearer(stale_bearer)
+
+        # navigate to a website
+        logger.info("Launching myTime")
+        self._browser.get(MYTIME_URL)
+        # If the listener hears nothing at all, every login would just time out waiting for the bearer
+        watchdog = threading.Timer(BROWSER_WAIT_SECONDS, self._warn_if_no_api_requests)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            # A logged in session makes authorized API calls straight away, otherwise we land on the login page
+            result = self._wait(lambda: self._bearer or self._present(By.ID, "loginID"))
+            if isinstance(result, str):
+                logger.success("Bearer re-harvested from the existing session!")
+                return result
+            if result is None:
+                logger.error("Timed out waiting for Login Page to load")
+                return None
+
+            return self._login()
+        finally:
+            watchdog.cancel()
+
+    def _warn_if_no_api_requests(self):
+        if not self._api_request_seen.is_set():
+            logger.warning(
+                f"No request to {API_HOST} seen in the {BROWSER_WAIT_SECONDS}s since myTime was loaded; "
+                "if no bearer turns up, the network listener isn't hearing the myTime tab"
+            )
+
+    def _login(self):
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.common.keys import Keys
+
+        browser = self._browser
+        logger.info("entering username and password...")
+        username = browser.find_element(By.ID, "loginID")
+        password = browser.find_element(By.ID, "password")
+        # This finds the login and the password box
+        logger.info("Entering Username")
+        username.click()
+        username.send_keys(self.tenant.employee_id)
+        username.send_keys(Keys.TAB)
+
+        logger.info("Entering Password")
+        username.click()
+        password.send_keys(self.tenant.password)
+        password.click()
+
+        logger.info("Pressing Submit")
+        browser.find_element(By.ID, "submit-button").submit()
+
+        try:
+            mfa_button = self._wait(
+                lambda: self._present(By.XPATH, '//*[contains(text(), "Authenticator")]')
+            )
+            if mfa_button is None:
+                raise Exception("Timed out waiting for the MFA prompt")
+            mfa_button.click()
+
+            otp = self._wait(lambda: self._present(By.ID, "totp-code"))
+            if otp is None:
+                raise Exception("Timed out waiting for the MFA code box")
+
+            logger.success("Account Valid! Logging into 2FA")
+            otp.click()
+            otp.send_keys(self.tenant.get_mfa_code())
+
+            browser.find_element(By.ID, "submit-button").click()
+            logger.info("Clicking submit...")
+        except Exception as e:
+            if config_file.headless:
+                logger.error(f"Auto-login failed in headless mode: {str(e)}")
+                return None
             logger.warning(f"Auto-login failed: {str(e)}")
             logger.info("Continuing with manual intervention - please log in manually")
-            # Wait for successful login by checking for network activity
-            while True:
-                time.sleep(2)
-                logs = browser.get_log("performance")
-                for entry in logs:
-                    try:
-                        message = json.loads(entry["message"])
-                        if "message" in message and "params" in message["message"]:
-                            params = message["message"]["params"]
-                            if "request" in params and "headers" in params["request"]:
-                                headers = params["request"]["headers"]
-                                if "authorization" in headers.keys() or "Authorization" in headers.keys():
-                                    auth_header = headers.get("authorization", headers.get("Authorization", ""))
-                                    if "Bearer " in auth_header:
-                                        browser.quit()
-                                        return auth_header
-                    except json.JSONDecodeError:
-                        continue
-                    except KeyError:
-                        continue
-
-    logger.success("Logged in successfully! Grabbing Bearer token")
-    logs = browser.get_log("performance")
-    for entry in logs:
-        if "Bearer " in str(entry["message"]):
-            json_message_data = json.loads(str(entry["message"]))
-            authorization_json = json_message_data["message"]["params"]["request"][
-                "headers"
-            ]["Authorization"]
-            logger.success("Bearer obtained! Closing...")
-            browser.close()
-            return authorization_json
+            token = self._wait_for_bearer(MANUAL_LOGIN_SECONDS)
+            if token is None:
+                logger.error(f"No manual login within {MANUAL_LOGIN_SECONDS}s")
+            return token
+
+        # The app calls the API with the new token as soon as the login goes through
+        token = self._wait_for_bearer(BEARER_CAPTURE_SECONDS)
+        if token is None:
+            logger.error("Logged in, but no Bearer token showed up")
+            return None
+        logger.success("Logged in successfully! Bearer obtained")
+        return token
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(tenant=None):
+    tenant = tenant or tenants.default_tenant()
+    with _workers_lock:
+        worker = _workers.get(tenant.employee_id)
+        if worker is None:
+            worker = _workers[tenant.employee_id] = BrowserWorker(tenant)
+        return worker
+
+
+@atexit.register
+def close_browsers():
+    for worker in list(_workers.values()):
+        worker.close()
+
+
+def get_token(tenant=None, stale_bearer=None):
+    # Logs into myTime as tenant (the scripts' default employee if not given) and returns its bearer token.
+    # A token equal to stale_bearer is never returned.
+    start = time.perf_counter()
+    token = get_worker(tenant).get_token(stale_bearer)
+    metrics.token_refresh_duration.observe(time.perf_counter() - start)
+    metrics.token_refreshes.inc("success" if token else "failure")
+    return token
@@ -1,77 +1,49 @@
-import datetime
 import functions
-import get_bearer
-import configparser
 from loguru import logger
+import tenants
+from token_manager import get_token_manager
 
-def get_posted_shifts():
-    logger.info("Starting get_posted_shifts function.")
-    logger.info("Reading Configuration file. ")
-    config = configparser.ConfigParser()
-    logger.info("Setting up store info object")
-    store_info = functions.Store()
-    config.read("config.cfg")
-    test_headers = {"Authorization": config["DEFAULT"]["Bearer"]}
+def get_posted_shifts(tenant=None):
+    """Records and notifies newly posted shifts for the next 4 weeks. Returns False if some weeks couldn't be fetched."""
+    tenant = tenant or tenants.default_tenant()
+    logger.info(f"Starting get_posted_shifts function for {tenant.name}.")
+    logger.info("Checking previously used token.")
+    # Raises TokenError if no working token can be had
+    headers = get_token_manager(tenant).ensure_valid()
     posted_shift_headers = {
-        "Authorization": config["DEFAULT"]["Bearer"],
+        **headers,
         "Page-Origin": "AVAILABLE_SHIFTS",
     }
-    logger.info("Testing previously used token.")
-    # test the token.
-    if functions.test_token(test_headers).status_code == 401:
-        # 401 means that response was invalid
-        logger.warning("Token invalid. Generating new token...")
-        # get new token
-        new_token = get_bearer.get_token()
-        logger.success("New Token obtained. Testing new token...")
-        # set new header and test new token
-        headers = {
-            "Authorization": new_token,
-        }
-        if functions.test_token(headers).status_code == 400:
-            # This may seem weird at first, but we're just checking if it authenticated properly, not the actual API
-            logger.success("New Token valid! Updating configuration file...")
-            config["DEFAULT"]["Bearer"] = new_token
-            # Update the new config file.
-            with open("config.cfg", "w") as configfile:
-                config.write(configfile)
-        else:
-            logger.error(
-                f"ERROR! New Token Invalid! error {functions.test_token(headers).status_code}"
-            )
-            logger.error("New Token invalid! Exiting...")
-            exit(-1)
 
-    logger.success("Existing Token valid!")
     # Now everything is verified and is working properly, we can start to work+
 
     logger.info("Starting API calls for available shifts.")
 
-    start_week_obj = datetime.datetime.now()
-    start_week_obj -= datetime.timedelta(start_week_obj.weekday() + 1)
-    end_week_obj = start_week_obj + datetime.timedelta(6)
-    # These date time objects allow us to easily move between calendar dates
-
-    for i in range(4):
-        # 4 to check 4 weeks of data
-        if i > 0:
-            start_week_obj += datetime.timedelta(7)
-            end_week_obj += datetime.timedelta(7)
-        logger.info("Calling available shifts API")
-        call = functions.call_available_shifts(
-            posted_shift_headers, start_week_obj.date(), end_week_obj.date()
-        )
-        call_json = call.json()
-        # call and check the results
-        if call.status_code != 200:
-            logger.error("Crap. API returned error exiting safely")
-            exit(-2)
+    def fetch_week(start_date, end_date):
+        logger.info(f"Calling available shifts API for week of {start_date}")
+        shifts = functions.call_available_shifts(posted_shift_headers, start_date, end_date, tenant)
         logger.success("Call Returned 200!")
+        return shifts
+
+    # 4 to check 4 weeks of data, fetched concurrently
+    weeks = functions.get_upcoming_weeks(4)
+    failed = False
+    for (start_date, end_date), shifts in zip(weeks, functions.fetch_weeks(fetch_week, weeks)):
+        if shifts is None:
+            logger.error(f"Crap. API returned error for week of {start_date}, skipping")
+            failed = True
+            continue
 
-        if not len(call_json["available_shifts"]):
+        if not shifts:
             logger.info("No available shifts found.")
             continue
         logger.success(f"Shifts found!")
 
-        for shift in call_json["available_shifts"]:
-            functions.seen_or_record(shift)
+        for shift in shifts:
+            functions.seen_or_record(shift, tenant)
+
+    if failed:
+        logger.error("Some weeks could not be fetched")
+        return False
+    logger.success("Posted shift scan complete")
+    return True
@@ -0,0 +1,58 @@
+import functools
+import itertools
+import sys
+from typing import Optional
+
+from loguru import logger
+
+import config_file
+
+# Default level, and overrides per module (subsystem) such as {"functions": "WARNING", "get_bearer": "DEBUG"}
+LOG_LEVEL = getattr(config_file, "LOG_LEVEL", "INFO")
+LOG_LEVELS = getattr(config_file, "LOG_LEVELS", {})
+# One JSON object per line instead of formatted text
+LOG_JSON = getattr(config_file, "LOG_JSON", False)
+# Write from a background thread so requests never wait on the terminal or disk
+LOG_ENQUEUE = getattr(config_file, "LOG_ENQUEUE", True)
+# File sink for the server (None for stderr only), and for top.py
+LOG_FILE = getattr(config_file, "LOG_FILE", None)
+SCRIPT_LOG_FILE = getattr(config_file, "SCRIPT_LOG_FILE", "script.log")
+LOG_ROTATION = getattr(config_file, "LOG_ROTATION", "500 MB")
+# Only write 1 in this many of the high-frequency messages logged through sampled(), e.g. cache hits
+LOG_SAMPLE_EVERY = getattr(config_file, "LOG_SAMPLE_EVERY", 100)
+
+_counters = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _min_level(name: Optional[str]) -> int:
+    # Most specific match wins, like loguru's own filters: "a.b" falls back to "a", then LOG_LEVEL
+    while name:
+        if name in LOG_LEVELS:
+            return logger.level(LOG_LEVELS[name]).no
+        name = name.rpartition(".")[0]
+    return logger.level(LOG_LEVEL).no
+
+
+def _filter(record) -> bool:
+    if record["level"].no < _min_level(record["name"]):
+        return False
+    sample = record["extra"].get("sample")
+    if sample is not None and LOG_SAMPLE_EVERY > 1:
+        counter = _counters.setdefault(sample, itertools.count())
+        return next(counter) % LOG_SAMPLE_EVERY == 0
+    return True
+
+
+def sampled(key: str):
+    """Logger for a high-frequency message; only 1 in LOG_SAMPLE_EVERY of them per key is written."""
+    return logger.bind(sample=key)
+
+
+def setup_logging(log_file: Optional[str] = LOG_FILE) -> None:
+    """Replaces loguru's default sink with the configured ones. Call once at startup."""
+    logger.remove()
+    options = {"level": 0, "filter": _filter, "enqueue": LOG_ENQUEUE, "serialize": LOG_JSON}
+    logger.add(sys.stderr, **options)
+    if log_file:
+        logger.add(log_file, rotation=LOG_ROTATION, **options)
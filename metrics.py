@@ -0,0 +1,147 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per bucket counts (not cumulative) + overflow, sum]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labels, label_values, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            inf = _format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Time spent handling HTTP requests.", ["route", "method"]
+)
+upstream_requests = Counter(
+    "upstream_requests_total", "Calls made to upstream APIs, by host and response status.", ["host", "status"]
+)
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to upstream APIs.", ["host"]
+)
+token_refreshes = Counter(
+    "token_refreshes_total", "Bearer token logins through the browser, by result.", ["result"]
+)
+token_refresh_duration = Histogram(
+    "token_refresh_duration_seconds",
+    "Time taken by browser logins for a bearer token.",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120),
+)
+sqlite_duration = Histogram(
+    "sqlite_query_duration_seconds", "Time spent in SQLite queries.", ["query"], buckets=DEFAULT_BUCKETS[:8]
+)
+
+_metrics = [request_duration, upstream_requests, upstream_duration, token_refreshes, token_refresh_duration, sqlite_duration]
+# Functions returning cache.Cache.stats() dicts, read at scrape time
+_cache_stats: List[Callable[[], dict]] = []
+
+_CACHE_METRICS: Tuple[Tuple[str, str, str, str], ...] = (
+    ("hits", "cache_hits_total", "counter", "Cache lookups answered with a fresh entry."),
+    ("stale_hits", "cache_stale_hits_total", "counter", "Cache lookups answered with a stale entry."),
+    ("misses", "cache_misses_total", "counter", "Cache lookups that found nothing usable."),
+    ("evictions", "cache_evictions_total", "counter", "Entries evicted to stay within the size limits."),
+    ("expirations", "cache_expirations_total", "counter", "Entries dropped after expiring."),
+    ("entries", "cache_entries", "gauge", "Entries currently held."),
+    ("bytes", "cache_bytes", "gauge", "Estimated size of the entries held, when a byte budget is set."),
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, *label_values) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *label_values)
+
+
+def register_cache(cache) -> None:
+    _cache_stats.append(cache.stats)
+
+
+def render() -> str:
+    """Every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    stats = [collect() for collect in _cache_stats]
+    for key, name, kind, help_text in _CACHE_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for cache_stats in stats:
+            lines.append(f'{name}{{cache="{_escape(cache_stats["name"])}"}} {cache_stats[key]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,191 @@
+import bisect
+import datetime
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+SEGMENT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@dataclass(frozen=True, slots=True)
+class Segment:
+    start: datetime.datetime
+    end: datetime.datetime
+    job_name: str
+    total_jobs: int
+    location: str
+    # job_path of every job worked in this segment
+    job_paths: tuple
+
+    @property
+    def start_text(self) -> str:
+        return self.start.strftime(SEGMENT_TIME_FORMAT)
+
+    @property
+    def end_text(self) -> str:
+        return self.end.strftime(SEGMENT_TIME_FORMAT)
+
+
+@dataclass(frozen=True, slots=True)
+class Day:
+    date: datetime.date
+    segments: tuple
+
+    @property
+    def working(self) -> bool:
+        return len(self.segments) > 0
+
+
+def calculate_shift_hours(start_datetime: datetime.datetime, end_datetime: datetime.datetime) -> float:
+    """Calculates shift duration accounting for lunch breaks."""
+    duration = end_datetime - start_datetime
+    hours = duration.total_seconds() / 3600
+    return hours - 0.5 if hours >= 5 else hours
+
+
+class ScheduleIndex:
+    """Lookups derived from a week's days, built the first time a Week's index is used."""
+
+    __slots__ = ("start_date", "days", "shift_starts", "shifts", "day_hours", "total_hours", "working_bits")
+
+    def __init__(self, days: Iterable[Day]):
+        days = sorted(days, key=lambda day: day.date)
+        self.start_date = days[0].date if days else None
+        self.days = {day.date: day for day in days}
+
+        # Every shift ordered by start time, with the start times alone for bisect
+        shifts = sorted(
+            ((segment.start, day, segment) for day in days for segment in day.segments),
+            key=lambda shift: shift[0],
+        )
+        self.shift_starts = [start for start, _, _ in shifts]
+        self.shifts = [(day, segment) for _, day, segment in shifts]
+
+        self.day_hours = {
+            day.date: sum(calculate_shift_hours(s.start, s.end) for s in day.segments)
+            for day in days
+        }
+        self.total_hours = sum(self.day_hours.values())
+
+        # Bit n is set when start_date + n days is a working day
+        self.working_bits = 0
+        for day in days:
+            if day.working:
+                self.working_bits |= 1 << (day.date - self.start_date).days
+
+    def is_working(self, date: datetime.date) -> bool:
+        if self.start_date is None or date < self.start_date:
+            return False
+        return bool(self.working_bits >> (date - self.start_date).days & 1)
+
+    def next_shift(self, after: datetime.datetime) -> Optional[tuple]:
+        """Returns (day, segment) of the first shift starting after the given time."""
+        i = bisect.bisect_right(self.shift_starts, after)
+        return self.shifts[i] if i < len(self.shifts) else None
+
+    def count_shifts_after(self, after: datetime.datetime) -> int:
+        return len(self.shift_starts) - bisect.bisect_right(self.shift_starts, after)
+
+    def next_day_off(self, from_date: datetime.date) -> datetime.date:
+        date = from_date
+        while self.is_working(date):
+            date += datetime.timedelta(days=1)
+        return date
+
+
+@dataclass(frozen=True, slots=True)
+class Week:
+    days: tuple
+    # Built from days on first use and kept with the Week, so unchanged weeks reuse it
+    _index: Optional[ScheduleIndex] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def index(self) -> ScheduleIndex:
+        if self._index is None:
+            object.__setattr__(self, "_index", ScheduleIndex(self.days))
+        return self._index
+
+    def to_dict(self) -> dict:
+        # Compact form for the persistent cache
+        return {
+            "days": [
+                [
+                    day.date.isoformat(),
+                    [
+                        [s.start_text, s.end_text, s.job_name, s.total_jobs, s.location, list(s.job_paths)]
+                        for s in day.segments
+                    ],
+                ]
+                for day in self.days
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Week":
+        return cls(
+            days=tuple(
+                Day(
+                    date=datetime.date.fromisoformat(date),
+                    segments=tuple(
+                        Segment(
+                            start=datetime.datetime.strptime(start, SEGMENT_TIME_FORMAT),
+                            end=datetime.datetime.strptime(end, SEGMENT_TIME_FORMAT),
+                            job_name=job_name,
+                            total_jobs=total_jobs,
+                            location=location,
+                            job_paths=tuple(job_paths),
+                        )
+                        for start, end, job_name, total_jobs, location, job_paths in segments
+                    ),
+                )
+                for date, segments in data["days"]
+            )
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class AvailableShift:
+    available_shift_id: int
+    start: datetime.datetime
+    end: datetime.datetime
+    shift_hours: float
+    job: str
+
+
+def parse_week(payload: dict) -> Week:
+    """Parses a weekly_schedules response into a Week."""
+    days = []
+    for day in payload["schedules"]:
+        segments = []
+        if day["total_display_segments"] > 0:
+            for segment in day["display_segments"]:
+                segments.append(
+                    Segment(
+                        start=datetime.datetime.strptime(segment["segment_start"], SEGMENT_TIME_FORMAT),
+                        end=datetime.datetime.strptime(segment["segment_end"], SEGMENT_TIME_FORMAT),
+                        job_name=segment["job_name"],
+                        total_jobs=segment["total_jobs"],
+                        location=segment["location"],
+                        job_paths=tuple(job["job_path"] for job in segment.get("jobs", [])),
+                    )
+                )
+        days.append(
+            Day(
+                date=datetime.date.fromisoformat(day["schedule_date"]),
+                segments=tuple(segments),
+            )
+        )
+    return Week(days=tuple(days))
+
+
+def parse_available_shifts(payload: dict) -> tuple:
+    """Parses an available_shifts response into AvailableShift records."""
+    return tuple(
+        AvailableShift(
+            available_shift_id=shift["available_shift_id"],
+            start=datetime.datetime.fromisoformat(shift["shift_start"]),
+            end=datetime.datetime.fromisoformat(shift["shift_end"]),
+            shift_hours=shift["shift_hours"],
+            job=shift["org_structure"]["job"],
+        )
+        for shift in payload["available_shifts"]
+    )
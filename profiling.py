@@ -0,0 +1,93 @@
+import asyncio
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import tracemalloc
+from typing import Optional
+
+from loguru import logger
+
+import config_file
+
+# Longest profile the endpoint will run
+PROFILE_MAX_SECONDS = getattr(config_file, "PROFILE_MAX_SECONDS", 60)
+# Also save every profile (.prof for pstats/snakeviz, .tracemalloc snapshot, .txt report) here
+PROFILE_DIR = getattr(config_file, "PROFILE_DIR", None)
+# Stack depth tracemalloc records per allocation; deeper is slower while profiling
+PROFILE_TRACEMALLOC_FRAMES = getattr(config_file, "PROFILE_TRACEMALLOC_FRAMES", 1)
+
+SORT_KEYS = ("cumulative", "tottime", "calls")
+
+_lock = asyncio.Lock()
+
+
+class ProfileInProgress(Exception):
+    pass
+
+
+async def capture(seconds: float, limit: int = 30, sort: str = "cumulative") -> str:
+    """Profiles the event loop thread for `seconds` and returns a CPU and allocation report."""
+    # Only one profiler can be attached to a thread at a time
+    if _lock.locked():
+        raise ProfileInProgress()
+
+    async with _lock:
+        logger.info(f"Profiling for {seconds:g}s")
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        # Every endpoint is async, so everything the server does for requests runs on this thread
+        # while we sleep: JSON handling, the caches, get_store_info_async and so on
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    report = _report(profiler, snapshot, seconds, limit, sort, started_tracing)
+
+    path = _store(profiler, snapshot, report) if PROFILE_DIR else None
+    if path is not None:
+        report += f"\nSaved to {path}.prof, {path}.tracemalloc and {path}.txt\n"
+    return report
+
+
+def _report(
+    profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot, seconds: float, limit: int, sort: str, fresh: bool
+) -> str:
+    out = io.StringIO()
+    out.write(f"CPU profile of the event loop thread over {seconds:g}s, top {limit} by {sort}\n")
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(limit)
+
+    since = "made during the profile" if fresh else "made since tracemalloc was started"
+    stats = snapshot.statistics("lineno")
+    out.write(f"\nAllocations {since} and still alive, top {limit} of {len(stats)} lines by size\n\n")
+    for stat in stats[:limit]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+
+def _store(profiler: cProfile.Profile, snapshot: tracemalloc.Snapshot, report: str) -> Optional[str]:
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"profile_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+        profiler.dump_stats(f"{path}.prof")
+        snapshot.dump(f"{path}.tracemalloc")
+        with open(f"{path}.txt", "w") as f:
+            f.write(report)
+    except OSError as e:
+        logger.error(f"Couldn't save profile to {PROFILE_DIR}: {e}")
+        return None
+    logger.info(f"Saved profile to {path}")
+    return path
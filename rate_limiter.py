@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+
+import config_file
+from file_lock import FileLock, LockTimeout
+
+# Requests per second and burst size allowed per upstream host, shared by every process on this machine
+RATE_LIMITS = getattr(config_file, "RATE_LIMITS", {"api.target.com": {"rate": 5, "burst": 20}})
+# Longest a request queues for its turn before giving up
+RATE_LIMIT_WAIT_SECONDS = getattr(config_file, "RATE_LIMIT_WAIT_SECONDS", 15)
+# Where the shared bucket state lives
+RATE_LIMIT_DIR = getattr(config_file, "RATE_LIMIT_DIR", ".")
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket:
+    """Token bucket kept in a file so uvicorn workers and the cron scripts draw from one budget.
+
+    Callers reserve a token, possibly one that only refills in the future, and then sleep
+    until it does. That queues bursts in arrival order instead of letting them retry in a loop.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, directory: str = RATE_LIMIT_DIR):
+        self.name = name
+        self._rate = rate
+        self._burst = burst
+        self._path = os.path.join(directory, f".ratelimit_{name}.json")
+
+    def _load(self, now: float) -> tuple:
+        try:
+            with open(self._path) as f:
+                state = json.load(f)
+            return state["tokens"], state["updated"]
+        except (OSError, ValueError, KeyError):
+            # No state yet (or a torn write): start with a full bucket
+            return float(self._burst), now
+
+    def reserve(self, max_wait: float) -> float:
+        """Takes a token, returning how long to sleep before using it. Raises RateLimited past max_wait."""
+        try:
+            with FileLock(f"{self._path}.lock", timeout=max_wait, poll_interval=0.005):
+                now = time.time()
+                tokens, updated = self._load(now)
+                tokens = min(self._burst, tokens + max(now - updated, 0) * self._rate)
+                wait = max(1 - tokens, 0) / self._rate
+                if wait > max_wait:
+                    raise RateLimited(f"{self.name} rate limited, next slot in {wait:.1f}s")
+                with open(self._path, "w") as f:
+                    json.dump({"tokens": tokens - 1, "updated": now}, f)
+                return wait
+        except LockTimeout:
+            raise RateLimited(f"Timed out waiting for the {self.name} rate limiter")
+
+    def acquire(self, max_wait: float = RATE_LIMIT_WAIT_SECONDS) -> None:
+        wait = self.reserve(max_wait)
+        if wait > 0:
+            logger.debug(f"Rate limiting {self.name}, waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    async def acquire_async(self, max_wait: float = RATE_LIMIT_WAIT_SECONDS) -> None:
+        # reserve() can block for up to max_wait on the file lock when other processes contend for it
+        wait = await asyncio.to_thread(self.reserve, max_wait)
+        if wait > 0:
+            logger.debug(f"Rate limiting {self.name}, waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host: str) -> Optional[TokenBucket]:
+    """The bucket for an upstream host, or None if RATE_LIMITS doesn't limit it."""
+    limit = RATE_LIMITS.get(host)
+    if limit is None:
+        return None
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket(host, limit["rate"], limit["burst"])
+        return bucket
@@ -0,0 +1,84 @@
+import asyncio
+import random
+import time
+
+from loguru import logger
+
+import config_file
+import get_posted_shifts
+import get_schedule
+import tenants
+from file_lock import FileLock, LockTimeout
+
+# Seconds between runs of the posted shift scan and of the schedule notifications; 0 turns a job off
+SCHEDULER_POSTED_SHIFTS_SECONDS = getattr(config_file, "SCHEDULER_POSTED_SHIFTS_SECONDS", 300)
+SCHEDULER_SCHEDULE_SECONDS = getattr(config_file, "SCHEDULER_SCHEDULE_SECONDS", 3600)
+# Spread runs by up to this fraction of the interval so processes started together don't run together
+SCHEDULER_JITTER = getattr(config_file, "SCHEDULER_JITTER", 0.1)
+
+
+def _jobs() -> list:
+    jobs = []
+    if config_file.run_posted_shifts and SCHEDULER_POSTED_SHIFTS_SECONDS:
+        jobs.append(("posted_shifts", get_posted_shifts.get_posted_shifts, SCHEDULER_POSTED_SHIFTS_SECONDS))
+    if SCHEDULER_SCHEDULE_SECONDS:
+        jobs.append(("schedule", get_schedule.start_get_schedule, SCHEDULER_SCHEDULE_SECONDS))
+    return jobs
+
+
+def run_job(name: str, job) -> None:
+    """Runs a job once for every tenant, unless another process (another uvicorn worker, a standalone
+    scheduler) is running it."""
+    lock = FileLock(f".scheduler_{name}.lock")
+    try:
+        lock.acquire(timeout=0)
+    except LockTimeout:
+        logger.info(f"Skipping {name}, it is already running in another process")
+        return
+
+    try:
+        for tenant in tenants.all_tenants():
+            start = time.monotonic()
+            try:
+                logger.info(f"Running scheduled job {name} for {tenant.name}")
+                if job(tenant):
+                    logger.success(f"Scheduled job {name} for {tenant.name} finished in {time.monotonic() - start:.1f}s")
+                else:
+                    logger.error(f"Scheduled job {name} for {tenant.name} finished with errors, retrying on the next run")
+            except Exception as e:
+                # Including TokenError; one tenant failing doesn't stop the others, and the next run
+                # tries again with whatever token the manager has by then
+                logger.error(f"Scheduled job {name} for {tenant.name} failed: {str(e)}")
+    finally:
+        lock.release()
+
+
+async def _job_loop(name: str, job, interval: float) -> None:
+    # Start somewhere in the first jitter window rather than right at startup
+    await asyncio.sleep(interval * random.uniform(0, SCHEDULER_JITTER))
+    while True:
+        start = time.monotonic()
+        # The jobs are synchronous; a run finishes before the next one is scheduled, so runs never overlap
+        await asyncio.to_thread(run_job, name, job)
+        delay = interval * random.uniform(1 - SCHEDULER_JITTER, 1 + SCHEDULER_JITTER)
+        await asyncio.sleep(max(delay - (time.monotonic() - start), 0))
+
+
+async def run() -> None:
+    """Runs every enabled job on its interval until cancelled. Used by server.py's lifespan and `python scheduler.py`."""
+    jobs = _jobs()
+    for name, _, interval in jobs:
+        logger.info(f"Scheduling {name} every {interval}s")
+    await asyncio.gather(*(_job_loop(*job) for job in jobs))
+
+
+if __name__ == "__main__":
+    import log_config
+    import functions
+
+    log_config.setup_logging(log_config.SCRIPT_LOG_FILE)
+    functions.check_cfg_file()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -1,20 +1,87 @@
-from cache import Cache
-from fastapi import FastAPI, HTTPException, Security, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Security, Depends
 from fastapi.security.api_key import APIKeyHeader
 from starlette.status import HTTP_403_FORBIDDEN
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import collections
+import contextvars
 import datetime
+import itertools
+import json
+import random
+import time
+import log_config
+log_config.setup_logging()
 import functions
-import get_bearer
-import configparser
+from cache import SingleFlight
+import upstream
+import timing
+import metrics
+import profiling
+import scheduler
 from loguru import logger
 from typing import Optional
 from pydantic import BaseModel
 import config_file
 from datetime import datetime as dt
-
-app = FastAPI()
-schedule_cache = Cache(ttl_seconds=300)
+from token_manager import get_token_manager, TokenError
+from tenants import Tenant, all_tenants, get_tenant_by_api_key
+from models import Day, Week, calculate_shift_hours
+
+# Keep the current and upcoming weeks warm in the background
+SCHEDULE_BACKGROUND_REFRESH = getattr(config_file, "SCHEDULE_BACKGROUND_REFRESH", True)
+SCHEDULE_WARM_WEEKS = getattr(config_file, "SCHEDULE_WARM_WEEKS", 4)
+# Refresh a week this many seconds before its cache entry expires
+SCHEDULE_REFRESH_AHEAD_SECONDS = getattr(config_file, "SCHEDULE_REFRESH_AHEAD_SECONDS", 30)
+SCHEDULE_REFRESH_CHECK_SECONDS = getattr(config_file, "SCHEDULE_REFRESH_CHECK_SECONDS", 15)
+# Longest range (in weeks) /schedule and the horizon parameters accept
+MAX_RANGE_WEEKS = getattr(config_file, "MAX_RANGE_WEEKS", 26)
+# How many weeks /next_shift and /next_day_off look ahead by default
+NEXT_SHIFT_HORIZON_WEEKS = getattr(config_file, "NEXT_SHIFT_HORIZON_WEEKS", 2)
+NEXT_DAY_OFF_HORIZON_WEEKS = getattr(config_file, "NEXT_DAY_OFF_HORIZON_WEEKS", 4)
+# Requests slower than this get a log entry with their stage breakdown
+SLOW_REQUEST_SECONDS = getattr(config_file, "SLOW_REQUEST_SECONDS", 2.0)
+# Renew tokens in the background so requests don't wait for a browser login
+TOKEN_BACKGROUND_RENEWAL = getattr(config_file, "TOKEN_BACKGROUND_RENEWAL", True)
+# Longest sleep between renewal checks, so tokens refreshed by other workers are noticed
+TOKEN_RENEW_CHECK_SECONDS = getattr(config_file, "TOKEN_RENEW_CHECK_SECONDS", 300)
+# Sleeps are shortened by up to this fraction so several workers don't renew in lockstep
+TOKEN_RENEW_JITTER = getattr(config_file, "TOKEN_RENEW_JITTER", 0.1)
+# Failed renewals are retried after this many seconds, doubling up to the maximum
+TOKEN_RENEW_RETRY_SECONDS = getattr(config_file, "TOKEN_RENEW_RETRY_SECONDS", 30)
+TOKEN_RENEW_MAX_RETRY_SECONDS = getattr(config_file, "TOKEN_RENEW_MAX_RETRY_SECONDS", 900)
+# Run the posted shift scan and schedule notifications (top.py's jobs) from inside the server
+SCHEDULER_IN_SERVER = getattr(config_file, "SCHEDULER_IN_SERVER", False)
+# API keys allowed to use the admin endpoints (/metrics, /debug/profile); none by default
+ADMIN_API_KEYS = getattr(config_file, "ADMIN_API_KEYS", [])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    loops = []
+    if TOKEN_BACKGROUND_RENEWAL:
+        loops.append(asyncio.create_task(token_renewal_loop()))
+    if SCHEDULE_BACKGROUND_REFRESH:
+        loops.append(asyncio.create_task(refresh_schedule_loop()))
+    if SCHEDULER_IN_SERVER:
+        loops.append(asyncio.create_task(scheduler.run()))
+    yield
+    for loop in loops:
+        loop.cancel()
+    await upstream.close_async_client()
+
+
+app = FastAPI(lifespan=lifespan)
+schedule_cache = functions.schedule_cache
+schedule_flight = SingleFlight()
+# (age in seconds, stale) of every schedule a request used, reported back in X-Data-Age and X-Data-Stale
+_data_ages: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("data_ages", default=None)
+# Keeps references to fire-and-forget refresh tasks until they finish
+_background_tasks = set()
+# Tenants whose token should be renewed right away, e.g. after an upstream 401
+_renewal_requested = set()
+_renewal_wakeup = asyncio.Event()
 
 # Add CORS middleware
 app.add_middleware(
@@ -25,45 +92,109 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def add_data_age_header(request: Request, call_next):
+    ages = []
+    token = _data_ages.set(ages)
+    try:
+        response = await call_next(request)
+    finally:
+        _data_ages.reset(token)
+    if ages:
+        response.headers["X-Data-Age"] = str(int(max(age for age, _ in ages)))
+        if any(stale for _, stale in ages):
+            response.headers["X-Data-Stale"] = "true"
+    return response
+
+@app.middleware("http")
+async def add_server_timing(request: Request, call_next):
+    start = time.perf_counter()
+    token = timing.start_request()
+    try:
+        response = await call_next(request)
+    finally:
+        spans = timing.end_request(token)
+    elapsed = time.perf_counter() - start
+    # Label by route template so unknown paths can't blow up the number of series
+    route = request.scope.get("route")
+    metrics.request_duration.observe(elapsed, route.path if route is not None else "unmatched", request.method)
+    # A StreamingResponse's body is sent after this returns, so for streamed responses (/schedule?stream=1)
+    # the header and the slow request log only cover the work done before the first byte
+    totals = timing.summarize(spans)
+    response.headers["Server-Timing"] = timing.server_timing(totals, elapsed)
+    if elapsed >= SLOW_REQUEST_SECONDS:
+        stages = {stage: round(seconds * 1000, 1) for stage, seconds in totals.items()}
+        logger.bind(slow_request=True, path=request.url.path, stages=stages).warning(
+            "Slow request: " + json.dumps({
+                "method": request.method,
+                "path": request.url.path,
+                "status": response.status_code,
+                "duration_ms": round(elapsed * 1000, 1),
+                "stages_ms": stages,
+            })
+        )
+    return response
+
+def record_data_age(age: float, stale: bool = False) -> None:
+    ages = _data_ages.get()
+    if ages is not None:
+        ages.append((age, stale))
+
 AUTH_NAME = "X-API-Key"
 auth_key_header = APIKeyHeader(name=AUTH_NAME, auto_error=False)
 
-async def get_auth_key(auth_key_header: str = Security(auth_key_header)):
+async def get_tenant(auth_key_header: str = Security(auth_key_header)) -> Tenant:
+    """Resolves the API key to the employee whose schedule the request is for."""
     if auth_key_header is None:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, detail="Could not validate API key"
         )
-    
-    if auth_key_header != config_file.AUTH_KEY:
+
+    with timing.span("auth"):
+        tenant = get_tenant_by_api_key(auth_key_header)
+    if tenant is None:
         raise HTTPException(
             status_code=HTTP_403_FORBIDDEN, detail="Could not validate API key"
         )
-    return auth_key_header
-
-async def validate_and_refresh_token(headers: dict) -> dict:
-    """Validates the current token and refreshes if needed."""
-    if functions.test_token(headers).status_code == 401:
-        logger.warning("Token invalid. Generating new token...")
-        new_token = get_bearer.get_token()
-        headers = {"Authorization": new_token}
-        
-        if functions.test_token(headers).status_code == 400:
-            config = configparser.ConfigParser()
-            config.read("config.cfg")
-            config["DEFAULT"]["Bearer"] = new_token
-            with open("config.cfg", "w") as configfile:
-                config.write(configfile)
-        else:
-            raise HTTPException(status_code=401, detail="Authentication failed")
-    return headers
+    return tenant
 
-def get_week_dates(offset_weeks: int = 0) -> tuple[dt, dt]:
-    """Returns start (Sunday) and end (Saturday) dates for a given week offset."""
-    start_date = dt.now()
-    start_date -= datetime.timedelta(start_date.weekday() + 1)
-    start_date += datetime.timedelta(weeks=offset_weeks)
-    end_date = start_date + datetime.timedelta(6)
-    return start_date, end_date
+async def require_admin(auth_key_header: str = Security(auth_key_header)) -> None:
+    if auth_key_header is None or auth_key_header not in ADMIN_API_KEYS:
+        raise HTTPException(
+            status_code=HTTP_403_FORBIDDEN, detail="Could not validate API key"
+        )
+
+async def validate_and_refresh_token(headers: dict, tenant: Tenant) -> dict:
+    """Validates the tenant's current token and refreshes if needed."""
+    try:
+        with timing.span("token_validate"):
+            return await get_token_manager(tenant).ensure_valid_async()
+    except TokenError as e:
+        logger.error(f"Token refresh failed: {str(e)}")
+        raise HTTPException(status_code=401, detail="Authentication failed")
+
+async def fetch_wfm(headers: dict, start_date: dt, end_date: dt, tenant: Tenant, refresh: bool = False) -> Week:
+    """Calls the WFM API, refreshing the token once if the call comes back 401."""
+    try:
+        try:
+            return await functions.call_wfm_async(headers, start_date.date(), end_date.date(), refresh, tenant)
+        except functions.UpstreamError as e:
+            if e.status_code != 401:
+                raise
+            logger.warning(f"WFM call for {tenant.name} returned 401, refreshing token")
+            get_token_manager(tenant).invalidate()
+            try:
+                headers = await validate_and_refresh_token(headers, tenant)
+            except HTTPException:
+                # Only now is the renewal loop needed; waking it after a refresh that worked would
+                # start a browser login for a token that is fine
+                request_token_renewal(tenant)
+                raise
+            return await functions.call_wfm_async(headers, start_date.date(), end_date.date(), refresh, tenant)
+    except functions.CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Schedule API is unavailable, try again later")
+    except functions.UpstreamError:
+        raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
 
 def format_shift_time(shift_date: dt, start_datetime: dt) -> str:
     """Returns human-readable day text (Today/Tomorrow/Day of week)."""
@@ -73,230 +204,431 @@ def format_shift_time(shift_date: dt, start_datetime: dt) -> str:
         return "Tomorrow"
     return shift_date.strftime("%A")
 
-def calculate_shift_hours(start_datetime: dt, end_datetime: dt) -> float:
-    """Calculates shift duration accounting for lunch breaks."""
-    duration = end_datetime - start_datetime
-    hours = duration.total_seconds() / 3600
-    return hours - 0.5 if hours >= 5 else hours
+def schedule_cache_key(tenant: Tenant, start_date: dt, end_date: dt) -> str:
+    return f"schedule_{tenant.employee_id}_{start_date.date()}_{end_date.date()}"
 
-async def get_schedule_data(headers: dict, start_date: dt, end_date: dt) -> dict:
+async def get_schedule_data(headers: dict, start_date: dt, end_date: dt, tenant: Tenant) -> Week:
     """Fetches and validates schedule data from the API."""
-    cache_key = f"schedule_{start_date.date()}_{end_date.date()}"
+    cache_key = schedule_cache_key(tenant, start_date, end_date)
     
-    # Try to get from cache first
-    cached_data = schedule_cache.get(cache_key)
-    if cached_data is not None:
-        logger.success(f"Cache hit for schedule {cache_key}")
-        return cached_data
+    # Try to get from cache first, serving stale data while it is refreshed in the background
+    with timing.span("schedule_cache"):
+        entry = await schedule_cache.get_entry_async(cache_key)
+    if entry is not None:
+        if entry.expires_in > 0:
+            log_config.sampled("schedule_cache_hit").success(f"Cache hit for schedule {cache_key}")
+        else:
+            logger.warning(f"Serving stale schedule {cache_key} ({int(entry.age)}s old), refreshing")
+            refresh_in_background(headers, start_date, end_date, tenant)
+        record_data_age(entry.age, stale=entry.expires_in <= 0)
+        return entry.value
         
     # If not in cache, fetch from API
     logger.warning(f"Cache miss for schedule {cache_key}, fetching from API")
-    call = functions.call_wfm(headers, start_date.date(), end_date.date())
-    if call.status_code != 200:
-        raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
-    
-    data = call.json()
-    schedule_cache.set(cache_key, data)
+    try:
+        data = await refresh_schedule_data(headers, start_date, end_date, tenant)
+    except HTTPException as e:
+        # Upstream is failing, answer with the last schedule we got for this week if there is one
+        last_good = await functions.get_last_good_week_async(start_date.date(), end_date.date(), tenant)
+        if e.status_code < 500 or last_good is None:
+            raise
+        logger.warning(f"Serving last good schedule {cache_key} ({int(last_good.age)}s old): {e.detail}")
+        record_data_age(last_good.age, stale=True)
+        return last_good.value
+    record_data_age(0)
     return data
 
-async def get_initial_headers() -> dict:
-    """Gets initial headers with authorization token."""
-    config = configparser.ConfigParser()
-    config.read("config.cfg")
-    return {"Authorization": config["DEFAULT"]["Bearer"]}
+async def refresh_schedule_data(headers: dict, start_date: dt, end_date: dt, tenant: Tenant) -> Week:
+    """Fetches a week straight from upstream into schedule_cache. Concurrent refreshes of a week share one fetch."""
+    cache_key = schedule_cache_key(tenant, start_date, end_date)
+
+    async def fetch() -> Week:
+        week = await fetch_wfm(headers, start_date, end_date, tenant, refresh=True)
+        await schedule_cache.set_async(cache_key, week)
+        return week
+
+    return await schedule_flight.do_async(cache_key, fetch)
+
+def refresh_in_background(headers: dict, start_date: dt, end_date: dt, tenant: Tenant) -> None:
+    async def refresh():
+        try:
+            await refresh_schedule_data(headers, start_date, end_date, tenant)
+        except Exception as e:
+            logger.error(f"Background refresh of week {start_date.date()} failed: {str(e)}")
+
+    task = asyncio.create_task(refresh())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def refresh_schedule_loop() -> None:
+    """Refreshes every tenant's warm weeks shortly before their cache entries expire."""
+    while True:
+        await asyncio.sleep(SCHEDULE_REFRESH_CHECK_SECONDS)
+        for tenant in all_tenants():
+            try:
+                headers = await validate_and_refresh_token(await get_initial_headers(tenant), tenant)
+                for start_week_obj, end_week_obj in get_upcoming_blocks(SCHEDULE_WARM_WEEKS):
+                    cache_key = schedule_cache_key(tenant, start_week_obj, end_week_obj)
+                    entry = await schedule_cache.get_entry_async(cache_key)
+                    if entry is None or entry.expires_in <= SCHEDULE_REFRESH_AHEAD_SECONDS:
+                        logger.info(f"Refreshing schedule {cache_key} in the background")
+                        await refresh_schedule_data(headers, start_week_obj, end_week_obj, tenant)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep serving the last good copy, we'll try again on the next pass
+                logger.error(f"Background schedule refresh for {tenant.name} failed: {str(e)}")
+
+def request_token_renewal(tenant: Tenant) -> None:
+    """Asks the renewal loop to renew the tenant's token now instead of at its scheduled time."""
+    _renewal_requested.add(tenant.employee_id)
+    _renewal_wakeup.set()
+
+async def token_renewal_loop() -> None:
+    """Renews every tenant's token shortly before requests would need a validation or a browser login."""
+    # employee_id -> (consecutive failures, monotonic time of the next attempt)
+    retries = {}
+    while True:
+        # Cleared before the pass so a request made meanwhile isn't missed
+        _renewal_wakeup.clear()
+        delay = TOKEN_RENEW_CHECK_SECONDS
+        for tenant in all_tenants():
+            manager = get_token_manager(tenant)
+            requested = tenant.employee_id in _renewal_requested
+            _renewal_requested.discard(tenant.employee_id)
+            failures, retry_at = retries.get(tenant.employee_id, (0, 0.0))
+
+            if requested or (manager.renewal_due_in() <= 0 and time.monotonic() >= retry_at):
+                try:
+                    await manager.renew_async()
+                    retries.pop(tenant.employee_id, None)
+                    logger.success(f"Token for {tenant.name} renewed")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    backoff = min(TOKEN_RENEW_RETRY_SECONDS * 2 ** (failures - 1), TOKEN_RENEW_MAX_RETRY_SECONDS)
+                    retries[tenant.employee_id] = (failures, time.monotonic() + backoff)
+                    logger.error(f"Token renewal for {tenant.name} failed ({failures} in a row), retrying in {backoff}s: {str(e)}")
+
+            if tenant.employee_id in retries:
+                delay = min(delay, retries[tenant.employee_id][1] - time.monotonic())
+            else:
+                delay = min(delay, manager.renewal_due_in())
+
+        delay = max(delay, 1) * random.uniform(1 - TOKEN_RENEW_JITTER, 1)
+        try:
+            await asyncio.wait_for(_renewal_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+def get_week_blocks(start: datetime.date, end: datetime.date) -> list[tuple[dt, dt]]:
+    """Splits a date range into the Sunday to Saturday weeks call_wfm works with."""
+    week_start = dt.combine(start - datetime.timedelta((start.weekday() + 1) % 7), datetime.time())
+    blocks = []
+    while week_start.date() <= end:
+        blocks.append((week_start, week_start + datetime.timedelta(6)))
+        week_start += datetime.timedelta(weeks=1)
+    return blocks
+
+def get_week_block(date: datetime.date) -> tuple[dt, dt]:
+    """Returns the Sunday to Saturday week containing date."""
+    return get_week_blocks(date, date)[0]
+
+def get_upcoming_blocks(weeks: int) -> list[tuple[dt, dt]]:
+    """Returns the current week and the ones after it, as used by the default endpoints."""
+    today = dt.now().date()
+    return get_week_blocks(today, today + datetime.timedelta(weeks=weeks - 1))
+
+async def get_weeks_data(headers: dict, blocks: list[tuple[dt, dt]], tenant: Tenant) -> list[Optional[Week]]:
+    """Fetches several weeks concurrently, in week order, with None for weeks that failed.
+
+    Weeks already in schedule_cache are served from it, so only missing weeks cost an upstream call.
+    """
+    semaphore = asyncio.Semaphore(functions.WEEK_FETCH_CONCURRENCY)
+
+    async def fetch_week(start_week_obj: dt, end_week_obj: dt) -> Week:
+        async with semaphore:
+            return await get_schedule_data(headers, start_week_obj, end_week_obj, tenant)
+
+    results = await asyncio.gather(
+        *(fetch_week(start, end) for start, end in blocks), return_exceptions=True
+    )
+    weeks = []
+    for (start_week_obj, _), result in zip(blocks, results):
+        # BaseException too: a week whose fetch was cancelled comes back as CancelledError
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to fetch week of {start_week_obj.date()}: {str(result)}")
+            weeks.append(None)
+        else:
+            weeks.append(result)
+
+    if all(week is None for week in weeks):
+        raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
+    return weeks
+
+def find_next_shift(weeks: list[Optional[Week]], after: dt) -> Optional[tuple]:
+    """Returns (day, segment) of the first shift after the given time, walking each week's own index in order."""
+    for week in weeks:
+        # A shift in a week we failed to fetch could come before any we can see
+        if week is None:
+            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
+        shift = week.index.next_shift(after)
+        if shift is not None:
+            return shift
+    return None
+
+def find_next_day_off(blocks: list[tuple[dt, dt]], weeks: list[Optional[Week]], from_date: datetime.date) -> datetime.date:
+    """Returns the first day off from from_date on, carrying on into the next week while every day is worked."""
+    date = from_date
+    for (_, end_week_obj), week in zip(blocks, weeks):
+        if end_week_obj.date() < date:
+            continue
+        # Days in a week we couldn't fetch can't be reported as days off
+        if week is None:
+            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
+        date = week.index.next_day_off(date)
+        if date <= end_week_obj.date():
+            return date
+    return date
+
+def check_horizon(horizon: Optional[int], default: int) -> int:
+    if horizon is None:
+        return default
+    if not 1 <= horizon <= MAX_RANGE_WEEKS:
+        raise HTTPException(status_code=400, detail=f"horizon must be between 1 and {MAX_RANGE_WEEKS} weeks")
+    return horizon
+
+async def get_initial_headers(tenant: Tenant) -> dict:
+    """Gets initial headers with the tenant's authorization token."""
+    with timing.span("token_headers"):
+        return get_token_manager(tenant).headers()
+
+async def format_schedule_day(day: Day, stores: dict) -> dict:
+    """Builds the /schedule entry for one day. stores caches Store lookups for the request."""
+    schedule_entry = {
+        "date": day.date.isoformat(),
+        "shifts": [],
+        "store_info": None
+    }
+
+    for segment in day.segments:
+        store_info = stores.get(segment.location)
+        if store_info is None:
+            store_info = stores[segment.location] = await functions.get_store_info_async(segment.location)
+
+        schedule_entry["shifts"].append({
+            "start_time": segment.start_text,
+            "end_time": segment.end_text,
+            "job_name": segment.job_name,
+            "total_jobs": segment.total_jobs,
+            "location": segment.location
+        })
+        schedule_entry["store_info"] = {
+            "address": store_info.address,
+            "timezone_offset": store_info.timezone_offset,
+            "store_id": store_info.store_id
+        }
+    return schedule_entry
+
+def in_range(day: Day, start: Optional[datetime.date], end: Optional[datetime.date]) -> bool:
+    return not ((start and day.date < start) or (end and day.date > end))
+
+async def stream_schedule(
+    headers: dict,
+    blocks: list[tuple[dt, dt]],
+    start: Optional[datetime.date],
+    end: Optional[datetime.date],
+    tenant: Tenant,
+):
+    """Yields NDJSON day entries week by week, in date order.
+
+    Up to WEEK_FETCH_CONCURRENCY weeks are fetched ahead of the one being sent, so however long the
+    range, only that many weeks are held in memory at once.
+    """
+    stores = {}
+
+    async def fetch_week(start_week_obj: dt, end_week_obj: dt) -> Optional[Week]:
+        try:
+            return await get_schedule_data(headers, start_week_obj, end_week_obj, tenant)
+        except Exception as e:
+            logger.error(f"Failed to fetch week of {start_week_obj.date()}: {str(e)}")
+            return None
+
+    upcoming = iter(blocks)
+    # (block, task) for every week being fetched, oldest first
+    pending = collections.deque()
+
+    def fetch_next(count: int) -> None:
+        for block in itertools.islice(upcoming, count):
+            pending.append((block, asyncio.ensure_future(fetch_week(*block))))
+
+    fetch_next(functions.WEEK_FETCH_CONCURRENCY)
+    try:
+        while pending:
+            (start_week_obj, end_week_obj), task = pending.popleft()
+            week = await task
+            fetch_next(1)
+
+            lines = None
+            if week is not None:
+                try:
+                    # A whole week at a time, so a failure never leaves a week half sent
+                    lines = [
+                        json.dumps(await format_schedule_day(day, stores)) + "\n"
+                        for day in week.days
+                        if in_range(day, start, end)
+                    ]
+                except Exception as e:
+                    logger.error(f"Failed to format week of {start_week_obj.date()}: {str(e)}")
+
+            if lines is None:
+                yield json.dumps({"failed_week": {
+                    "start_date": start_week_obj.strftime("%Y-%m-%d"),
+                    "end_date": end_week_obj.strftime("%Y-%m-%d")
+                }}) + "\n"
+                continue
+            for line in lines:
+                yield line
+    finally:
+        # The client went away, don't keep fetching for it
+        for _, task in pending:
+            task.cancel()
 
 @app.get("/schedule")
-async def get_schedule(auth_key: str = Depends(get_auth_key)):
+async def get_schedule(
+    start: Optional[datetime.date] = None,
+    end: Optional[datetime.date] = None,
+    stream: bool = False,
+    tenant: Tenant = Depends(get_tenant),
+):
+    """Schedule for start..end (inclusive), or the current and next three weeks when no range is given.
+
+    With ?stream=1 the days are sent as newline-delimited JSON, a week at a time in date order.
+    """
+    if start is None and end is None:
+        blocks = get_upcoming_blocks(4)
+    else:
+        start = start or dt.now().date()
+        end = end or start + datetime.timedelta(6)
+        if end < start:
+            raise HTTPException(status_code=400, detail="end must not be before start")
+        blocks = get_week_blocks(start, end)
+        if len(blocks) > MAX_RANGE_WEEKS:
+            raise HTTPException(status_code=400, detail=f"Range is limited to {MAX_RANGE_WEEKS} weeks")
+
     try:
         logger.info("Starting schedule fetch")
-        store_info = functions.Store()
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
+        if stream:
+            return StreamingResponse(
+                stream_schedule(headers, blocks, start, end, tenant), media_type="application/x-ndjson"
+            )
+
+        stores = {}
         schedule_data = []
+        failed_weeks = []
+
+        # Get every week in the range
+        weeks = await get_weeks_data(headers, blocks, tenant)
+        for (start_week_obj, end_week_obj), week in zip(blocks, weeks):
+            if week is None:
+                failed_weeks.append({
+                    "start_date": start_week_obj.strftime("%Y-%m-%d"),
+                    "end_date": end_week_obj.strftime("%Y-%m-%d")
+                })
+                continue
 
-        # Get 4 weeks of schedules
-        for i in range(4):
-            start_week_obj, end_week_obj = get_week_dates(i)
-            call_json = await get_schedule_data(headers, start_week_obj, end_week_obj)
-            
             # Process each day's schedule
-            for day in call_json["schedules"]:
-                schedule_entry = {
-                    "date": day["schedule_date"],
-                    "shifts": [],
-                    "store_info": None
-                }
+            for day in week.days:
+                if in_range(day, start, end):
+                    schedule_data.append(await format_schedule_day(day, stores))
 
-                if day["total_display_segments"] > 0:
-                    for segment in day["display_segments"]:
-                        shift_location = segment["location"]
-                        
-                        if store_info.store_id != shift_location:
-                            store_info = functions.get_store_info(shift_location)
-                            
-                        schedule_entry["shifts"].append({
-                            "start_time": segment["segment_start"],
-                            "end_time": segment["segment_end"],
-                            "job_name": segment["job_name"],
-                            "total_jobs": segment["total_jobs"],
-                            "location": shift_location
-                        })
-                        schedule_entry["store_info"] = {
-                            "address": store_info.address,
-                            "timezone_offset": store_info.timezone_offset,
-                            "store_id": store_info.store_id
-                        }
-
-                schedule_data.append(schedule_entry)
-
-        return {"schedule": schedule_data}
+        return {"schedule": schedule_data, "failed_weeks": failed_weeks}
 
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/next_shift")
-async def get_next_shift(auth_key: str = Depends(get_auth_key)):
+async def get_next_shift(horizon: Optional[int] = None, tenant: Tenant = Depends(get_tenant)):
+    """Next upcoming shift within the next horizon weeks (current week included)."""
+    horizon = check_horizon(horizon, NEXT_SHIFT_HORIZON_WEEKS)
     try:
         logger.info("Starting next shift fetch")
         store_info = functions.Store()
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
 
-        # Get current Sunday and next Saturday
-        start_date = dt.now()
-        start_date -= datetime.timedelta(start_date.weekday() + 1)  # Adjust to previous Sunday
-        end_date = start_date + datetime.timedelta(6)  # Get to Saturday
+        # Get the current week and the ones after it up to the horizon
+        blocks = get_upcoming_blocks(horizon)
+        next_shift = find_next_shift(await get_weeks_data(headers, blocks, tenant), dt.now())
+        if next_shift is None:
+            return {"next_shift": None}
 
-        call = functions.call_wfm(headers, start_date.date(), end_date.date())
-        
-        if call.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
+        day, segment = next_shift
+        # Get store info
+        if store_info.store_id != segment.location:
+            store_info = await functions.get_store_info_async(segment.location)
 
-        call_json = call.json()
-        
-        # Find the next shift
-        for day in call_json["schedules"]:
-            if day["total_display_segments"] > 0:
-                for segment in day["display_segments"]:
-                    shift_date = dt.strptime(day["schedule_date"], "%Y-%m-%d")
-                    # Parse full datetime and extract time
-                    start_datetime = dt.strptime(segment["segment_start"], "%Y-%m-%d %H:%M:%S")
-                    end_datetime = dt.strptime(segment["segment_end"], "%Y-%m-%d %H:%M:%S")
-                    start_time = start_datetime.time()
-                    end_time = end_datetime.time()
-                    
-                    shift_start = dt.combine(shift_date.date(), start_time)
-                    
-                    if shift_start > dt.now():
-                        # Get store info
-                        if store_info.store_id != segment["location"]:
-                            store_info = functions.get_store_info(segment["location"])
-                        
-                        # Format the date/time for human readable output
-                        if shift_start.date() == dt.now().date():
-                            day_text = "Today"
-                        elif shift_start.date() == (dt.now() + datetime.timedelta(1)).date():
-                            day_text = "Tomorrow"
-                        else:
-                            day_text = shift_start.strftime("%A")
-                        
-                        # Format times removing leading zeros
-                        start_time_str = start_time.strftime("%I%p").lower().lstrip('0')
-                        end_time_str = end_time.strftime("%I%p").lower().lstrip('0')
-                        
-                        return {
-                            "next_shift": {
-                                "human_readable": f"{day_text} from {start_time_str} to {end_time_str}",
-                                "date": day["schedule_date"],
-                                "start_time": start_datetime.strftime("%H:%M"),
-                                "end_time": end_datetime.strftime("%H:%M"),
-                                "job_name": segment["job_name"],
-                                "location": {
-                                    "store_id": store_info.store_id,
-                                    "address": store_info.address,
-                                    "timezone_offset": store_info.timezone_offset
-                                }
-                            }
-                        }
-        
-        return {"next_shift": None}
+        # Format the date/time for human readable output
+        day_text = format_shift_time(dt.combine(day.date, segment.start.time()), segment.start)
+
+        # Format times removing leading zeros
+        start_time_str = segment.start.strftime("%I%p").lower().lstrip('0')
+        end_time_str = segment.end.strftime("%I%p").lower().lstrip('0')
+
+        return {
+            "next_shift": {
+                "human_readable": f"{day_text} from {start_time_str} to {end_time_str}",
+                "date": day.date.isoformat(),
+                "start_time": segment.start.strftime("%H:%M"),
+                "end_time": segment.end.strftime("%H:%M"),
+                "job_name": segment.job_name,
+                "location": {
+                    "store_id": store_info.store_id,
+                    "address": store_info.address,
+                    "timezone_offset": store_info.timezone_offset
+                }
+            }
+        }
 
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/summary")
-async def get_schedule_summary(auth_key: str = Depends(get_auth_key)):
+async def get_schedule_summary(tenant: Tenant = Depends(get_tenant)):
     try:
         logger.info("Starting schedule summary fetch")
-        store_info = functions.Store()
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
+
+        now = dt.now()
+        # The Sunday to Saturday week we're in
+        start_date, end_date = get_week_block(now.date())
+        week = await get_schedule_data(headers, start_date, end_date, tenant)
+
+        index = week.index
+        # Hours already account for the 30 min lunch break on shifts of 5 hours or longer
+        total_hours = index.total_hours
+        upcoming_shifts = index.count_shifts_after(now)
+        next_shift = None
 
-        # Get current Sunday and next Saturday
-        start_date = dt.now()
-        start_date -= datetime.timedelta(start_date.weekday() + 1)
-        end_date = start_date + datetime.timedelta(6)
+        upcoming = index.next_shift(now)
+        if upcoming is not None:
+            day, segment = upcoming
+            next_shift_hours = calculate_shift_hours(segment.start, segment.end)
 
-        call = functions.call_wfm(headers, start_date.date(), end_date.date())
-        
-        if call.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
+            # Format the date/time
+            day_text = format_shift_time(dt.combine(day.date, segment.start.time()), segment.start).lower()
 
-        call_json = call.json()
-        
-        upcoming_shifts = 0
-        next_shift = None
-        next_shift_hours = 0
-        total_hours = 0
-        today_hours = 0
-        today = dt.now().date()
-        
-        # Process all shifts
-        for day in call_json["schedules"]:
-            if day["total_display_segments"] > 0:
-                for segment in day["display_segments"]:
-                    shift_date = dt.strptime(day["schedule_date"], "%Y-%m-%d")
-                    start_datetime = dt.strptime(segment["segment_start"], "%Y-%m-%d %H:%M:%S")
-                    end_datetime = dt.strptime(segment["segment_end"], "%Y-%m-%d %H:%M:%S")
-                    
-                    # Calculate shift duration
-                    duration = end_datetime - start_datetime
-                    shift_hours = duration.total_seconds() / 3600
-                    
-                    # Subtract 30 min lunch break for shifts 5 hours or longer
-                    if shift_hours >= 5:
-                        shift_hours -= 0.5
-                    
-                    # Track today's hours separately
-                    if shift_date.date() == today:
-                        today_hours += shift_hours
-                    
-                    total_hours += shift_hours
-                    
-                    if start_datetime > dt.now():
-                        upcoming_shifts += 1
-                        
-                        if next_shift is None:
-                            next_shift_hours = shift_hours
-                            # Get store info if needed
-                            if store_info.store_id != segment["location"]:
-                                store_info = functions.get_store_info(segment["location"])
-                            
-                            # Format the date/time
-                            if shift_date.date() == dt.now().date():
-                                day_text = "today"
-                            elif shift_date.date() == (dt.now() + datetime.timedelta(1)).date():
-                                day_text = "tomorrow"
-                            else:
-                                day_text = shift_date.strftime("%A").lower()
-                            
-                            start_time = start_datetime.strftime("%I:%M%p").lower().lstrip('0')
-                            end_time = end_datetime.strftime("%I:%M%p").lower().lstrip('0')
-                            
-                            hours_display = int(next_shift_hours) if next_shift_hours.is_integer() else round(next_shift_hours, 1)
-                            next_shift = f"{day_text} from {start_time} to {end_time}, totaling {hours_display} hours"
+            start_time = segment.start.strftime("%I:%M%p").lower().lstrip('0')
+            end_time = segment.end.strftime("%I:%M%p").lower().lstrip('0')
+
+            hours_display = int(next_shift_hours) if next_shift_hours.is_integer() else round(next_shift_hours, 1)
+            next_shift = f"{day_text} from {start_time} to {end_time}, totaling {hours_display} hours"
 
         # Create the summary message
         if upcoming_shifts == 0:
@@ -322,95 +654,60 @@ async def get_schedule_summary(auth_key: str = Depends(get_auth_key)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/working_today")
-async def working_today(auth_key: str = Depends(get_auth_key)):
+async def working_today(tenant: Tenant = Depends(get_tenant)):
     try:
         logger.info("Checking if working today")
         store_info = functions.Store()
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
-
-        # Get current Sunday and next Saturday
-        start_date = dt.now()
-        start_date -= datetime.timedelta(start_date.weekday() + 1)  # Adjust to previous Sunday
-        end_date = start_date + datetime.timedelta(6)  # Get to Saturday
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
 
-        call = functions.call_wfm(headers, start_date.date(), end_date.date())
-        
-        if call.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
-
-        call_json = call.json()
         today = dt.now().date()
-        
+        start_date, end_date = get_week_block(today)
+        week = await get_schedule_data(headers, start_date, end_date, tenant)
+
         # Find today's schedule
-        for day in call_json["schedules"]:
-            if day["schedule_date"] == today.strftime("%Y-%m-%d"):
-                return {"working": day["total_display_segments"] > 0}
-        
-        return {"working": False}
+        return {"working": week.index.is_working(today)}
 
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/working_tomorrow")
-async def working_tomorrow(auth_key: str = Depends(get_auth_key)):
+async def working_tomorrow(tenant: Tenant = Depends(get_tenant)):
     try:
         logger.info("Checking if working tomorrow")
         store_info = functions.Store()
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
-
-        # Get current Sunday and next Saturday
-        start_date = dt.now()
-        start_date -= datetime.timedelta(start_date.weekday() + 1)  # Adjust to previous Sunday
-        end_date = start_date + datetime.timedelta(6)  # Get to Saturday
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
 
-        call = functions.call_wfm(headers, start_date.date(), end_date.date())
-        
-        if call.status_code != 200:
-            raise HTTPException(status_code=500, detail="Failed to fetch schedule from API")
-
-        call_json = call.json()
+        # On Saturdays tomorrow is in next week's schedule
         tomorrow = (dt.now() + datetime.timedelta(days=1)).date()
-        
+        start_date, end_date = get_week_block(tomorrow)
+        week = await get_schedule_data(headers, start_date, end_date, tenant)
+
         # Find tomorrow's schedule
-        for day in call_json["schedules"]:
-            if day["schedule_date"] == tomorrow.strftime("%Y-%m-%d"):
-                return {"working": day["total_display_segments"] > 0}
-        
-        return {"working": False}
+        return {"working": week.index.is_working(tomorrow)}
 
     except Exception as e:
         logger.error(f"Error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/next_day_off")
-async def get_next_day_off(auth_key: str = Depends(get_auth_key)):
+async def get_next_day_off(horizon: Optional[int] = None, tenant: Tenant = Depends(get_tenant)):
     """Find the next day you're not scheduled to work"""
+    horizon = check_horizon(horizon, NEXT_DAY_OFF_HORIZON_WEEKS)
     try:
         logger.info("Finding next day off")
-        headers = await get_initial_headers()
-        headers = await validate_and_refresh_token(headers)
+        headers = await get_initial_headers(tenant)
+        headers = await validate_and_refresh_token(headers, tenant)
         
-        # Get schedules for the next 4 weeks to ensure we find a day off
-        working_days = set()
+        # Get schedules for the next few weeks to ensure we find a day off
         today = dt.now().date()
         
-        # Collect all working days
-        for i in range(4):
-            start_week_obj, end_week_obj = get_week_dates(i)
-            call_json = await get_schedule_data(headers, start_week_obj, end_week_obj)
-            
-            for day in call_json["schedules"]:
-                if day["total_display_segments"] > 0:
-                    working_days.add(dt.strptime(day["schedule_date"], "%Y-%m-%d").date())
-        
-        # Find the next day off
-        current_date = today
-        while current_date in working_days:
-            current_date += datetime.timedelta(days=1)
-            
+        blocks = get_upcoming_blocks(horizon)
+        current_date = find_next_day_off(blocks, await get_weeks_data(headers, blocks, tenant), today)
+
+
         # Format the response
         days_until = (current_date - today).days
         
@@ -439,16 +736,33 @@ async def get_next_day_off(auth_key: str = Depends(get_auth_key)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/clear_cache")
-async def clear_cache(auth_key: str = Depends(get_auth_key)):
-    """Clear the schedule cache"""
+async def clear_cache(tenant: Tenant = Depends(get_tenant)):
+    """Clear the caller's schedule cache"""
     try:
-        logger.info("Clearing schedule cache")
-        schedule_cache.clear()
+        logger.info(f"Clearing schedule cache for {tenant.name}")
+        schedule_cache.clear(f"schedule_{tenant.employee_id}_")
         return {"message": "Cache cleared successfully"}
     except Exception as e:
         logger.error(f"Error clearing cache: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(require_admin)])
+async def get_metrics():
+    """Prometheus text format metrics for requests, upstream calls, caches and token refreshes."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/debug/profile", response_class=PlainTextResponse, include_in_schema=False, dependencies=[Depends(require_admin)])
+async def profile(seconds: float = 10, limit: int = 30, sort: str = "cumulative"):
+    """Profiles the running server for a few seconds and returns the cProfile and tracemalloc report."""
+    if not 0 < seconds <= profiling.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {profiling.PROFILE_MAX_SECONDS}")
+    if sort not in profiling.SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(profiling.SORT_KEYS)}")
+    try:
+        return PlainTextResponse(await profiling.capture(seconds, limit, sort))
+    except profiling.ProfileInProgress:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
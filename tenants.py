@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import pyotp
+
+import config_file
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """One employee served by this process, with their own credentials and bearer token."""
+
+    name: str
+    api_key: str
+    employee_id: int
+    password: str
+    store_number: int
+    totp_secret: str = ""
+    # File holding this employee's bearer token
+    token_path: str = "config.cfg"
+    # Pushover user key their notifications go to; none are sent without one
+    pushover_user_key: str = ""
+
+    def get_mfa_code(self) -> str:
+        return pyotp.TOTP(self.totp_secret).now()
+
+
+def _default_tenant() -> Tenant:
+    # The single employee configured with the original EMPLOYEE_ID/PASSWORD/totp settings
+    return Tenant(
+        name="default",
+        api_key=config_file.AUTH_KEY,
+        employee_id=config_file.EMPLOYEE_ID,
+        password=config_file.PASSWORD,
+        store_number=config_file.STORE_NUMBER,
+        totp_secret=config_file.totp.secret,
+        pushover_user_key=config_file.PUSHOVER_USER_API_KEY,
+    )
+
+
+def _load_tenants() -> List[Tenant]:
+    configured = getattr(config_file, "TENANTS", [])
+    if not configured:
+        return [_default_tenant()]
+
+    tenants = []
+    for i, entry in enumerate(configured):
+        tenants.append(
+            Tenant(
+                name=entry.get("name", str(entry["employee_id"])),
+                api_key=entry["api_key"],
+                employee_id=entry["employee_id"],
+                password=entry["password"],
+                store_number=entry.get("store_number", config_file.STORE_NUMBER),
+                totp_secret=entry.get("totp_secret", ""),
+                # The first tenant keeps config.cfg so existing setups carry on working
+                token_path=entry.get(
+                    "token_path", "config.cfg" if i == 0 else f"config_{entry['employee_id']}.cfg"
+                ),
+                # Likewise PUSHOVER_USER_API_KEY, other tenants' shifts must not go to the first one's phone
+                pushover_user_key=entry.get(
+                    "pushover_user_key", config_file.PUSHOVER_USER_API_KEY if i == 0 else ""
+                ),
+            )
+        )
+    return tenants
+
+
+_tenants = _load_tenants()
+_tenants_by_key: Dict[str, Tenant] = {tenant.api_key: tenant for tenant in _tenants}
+
+
+def all_tenants() -> List[Tenant]:
+    return list(_tenants)
+
+
+def default_tenant() -> Tenant:
+    """The tenant the command line scripts run for."""
+    return _tenants[0]
+
+
+def get_tenant_by_api_key(api_key: str) -> Optional[Tenant]:
+    return _tenants_by_key.get(api_key)
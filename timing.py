@@ -0,0 +1,63 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+# (stage, start, end) perf_counter times of every span recorded while handling the current request
+_spans: contextvars.ContextVar[Optional[List[Tuple[str, float, float]]]] = contextvars.ContextVar("spans", default=None)
+
+
+def start_request() -> contextvars.Token:
+    """Starts collecting spans for the current request. Pass the result to end_request."""
+    return _spans.set([])
+
+
+def end_request(token: contextvars.Token) -> List[Tuple[str, float, float]]:
+    spans = _spans.get() or []
+    _spans.reset(token)
+    return spans
+
+
+def record(stage: str, start: float, end: float) -> None:
+    spans = _spans.get()
+    if spans is not None:
+        spans.append((stage, start, end))
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Times the enclosed block as one stage of the current request. Cheap no-op outside a request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, start, time.perf_counter())
+
+
+def summarize(spans: List[Tuple[str, float, float]]) -> dict:
+    # Wall clock seconds per stage, in the order the stages first ran. Spans of a stage that overlap,
+    # e.g. several weeks fetched concurrently, are merged rather than added up, so no stage can take
+    # longer than the request itself.
+    by_stage = {}
+    for stage, start, end in spans:
+        by_stage.setdefault(stage, []).append((start, end))
+
+    totals = {}
+    for stage, intervals in by_stage.items():
+        intervals.sort()
+        seconds = 0.0
+        current_start, current_end = intervals[0]
+        for start, end in intervals[1:]:
+            if start > current_end:
+                seconds += current_end - current_start
+                current_start = start
+            current_end = max(current_end, end)
+        totals[stage] = seconds + current_end - current_start
+    return totals
+
+
+def server_timing(totals: dict, total_seconds: float) -> str:
+    """Formats stage totals as a Server-Timing header value (durations in milliseconds)."""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
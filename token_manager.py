@@ -0,0 +1,306 @@
+import asyncio
+import base64
+import binascii
+import configparser
+import contextvars
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from loguru import logger
+
+import config_file
+import functions
+import get_bearer
+import tenants
+import timing
+from file_lock import FileLock, LockTimeout, atomic_write
+
+# How long a token without an exp claim is trusted after a successful test_token call
+TOKEN_TRUST_SECONDS = getattr(config_file, "TOKEN_TRUST_SECONDS", 1800)
+# Treat the token as expired this many seconds before it actually is
+TOKEN_EXPIRY_MARGIN = getattr(config_file, "TOKEN_EXPIRY_MARGIN", 60)
+# How long a request waits for someone else's token refresh before giving up
+TOKEN_REFRESH_WAIT_SECONDS = getattr(config_file, "TOKEN_REFRESH_WAIT_SECONDS", 120)
+# Background renewal starts this many seconds before a request would have to validate or refresh
+TOKEN_RENEW_AHEAD_SECONDS = getattr(config_file, "TOKEN_RENEW_AHEAD_SECONDS", 300)
+# Browser logins allowed to run at once across tenants (each tenant still refreshes one at a time)
+LOGIN_WORKERS = getattr(config_file, "LOGIN_WORKERS", 1)
+
+# Selenium logins run here so a browser session never blocks the event loop
+_login_executor = ThreadPoolExecutor(max_workers=LOGIN_WORKERS, thread_name_prefix="chrome-login")
+
+
+class TokenError(Exception):
+    pass
+
+
+def token_status(response) -> Optional[bool]:
+    """Reads a test_token response: True if the token works, False if it was rejected, None if upstream couldn't say."""
+    # test_token asks for a week the API refuses with a 400, but only once the token authenticated
+    if response.status_code == 400:
+        return True
+    if response.status_code in (401, 403):
+        return False
+    # 429s and 5xx say nothing about the token, so it is neither trusted nor replaced
+    return None
+
+
+def get_token_expiry(bearer: str) -> Optional[float]:
+    """Returns the JWT exp claim of a bearer token as a unix timestamp, if it has one."""
+    token = bearer.split(" ", 1)[-1].strip()
+    parts = token.split(".")
+    if len(parts) != 3:
+        return None
+    payload = parts[1] + "=" * (-len(parts[1]) % 4)
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+    except (binascii.Error, ValueError):
+        return None
+    exp = claims.get("exp") if isinstance(claims, dict) else None
+    if isinstance(exp, (int, float)):
+        return float(exp)
+    return None
+
+
+class TokenManager:
+    def __init__(
+        self,
+        tenant: Optional[tenants.Tenant] = None,
+        trust_seconds: int = TOKEN_TRUST_SECONDS,
+        margin_seconds: int = TOKEN_EXPIRY_MARGIN,
+        refresh_wait_seconds: int = TOKEN_REFRESH_WAIT_SECONDS,
+        renew_ahead_seconds: int = TOKEN_RENEW_AHEAD_SECONDS,
+    ):
+        self.tenant = tenant or tenants.default_tenant()
+        self._config_path = self.tenant.token_path
+        self._trust_seconds = trust_seconds
+        self._margin_seconds = margin_seconds
+        self._bearer = ""
+        self._valid_until = 0.0
+        self._mtime = None
+        self._refresh_wait_seconds = refresh_wait_seconds
+        self._renew_ahead_seconds = renew_ahead_seconds
+        # Only one refresh per process, and the file lock makes it one across processes
+        self._refresh_lock = threading.Lock()
+        self._state_lock = threading.RLock()
+        self._refresh_future = None
+
+    def _load(self) -> None:
+        # Re-read config.cfg only when it changed on disk (another process may have refreshed it)
+        try:
+            mtime = os.path.getmtime(self._config_path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime and self._bearer:
+            return
+
+        config = configparser.ConfigParser()
+        config.read(self._config_path)
+        bearer = config["DEFAULT"].get("Bearer", "")
+        validated = config["DEFAULT"].getfloat("Validated", fallback=0.0)
+        self._mtime = mtime
+        if bearer != self._bearer:
+            self._bearer = bearer
+            self._valid_until = 0.0
+        self._valid_until = max(self._valid_until, self._expiry_from(validated))
+
+    def _expiry_from(self, validated_at: float) -> float:
+        # The exp claim wins when the token has one, otherwise trust it for a while after validation
+        exp = get_token_expiry(self._bearer) if self._bearer else None
+        if exp is not None:
+            return exp
+        if validated_at:
+            return validated_at + self._trust_seconds
+        return 0.0
+
+    def _lock_file(self, timeout: Optional[float]) -> FileLock:
+        return FileLock(f"{self._config_path}.lock", timeout=timeout)
+
+    def _write(self, validated_at: float, only_if_current: bool = False) -> bool:
+        # Callers hold the config file lock. With only_if_current, nothing is written when another
+        # worker stored a different token since we loaded ours, so we never put a replaced token back.
+        config = configparser.ConfigParser()
+        config.read(self._config_path)
+        if only_if_current and config["DEFAULT"].get("Bearer", "") != self._bearer:
+            return False
+        config["DEFAULT"]["Bearer"] = self._bearer
+        config["DEFAULT"]["Validated"] = str(validated_at)
+        buffer = io.StringIO()
+        config.write(buffer)
+        atomic_write(self._config_path, buffer.getvalue())
+        self._mtime = os.path.getmtime(self._config_path)
+        return True
+
+    @property
+    def bearer(self) -> str:
+        self._load()
+        return self._bearer
+
+    @property
+    def expires_at(self) -> float:
+        """Unix timestamp after which the token has to be validated again."""
+        self._load()
+        return self._valid_until
+
+    def headers(self) -> dict:
+        return {"Authorization": self.bearer}
+
+    def needs_validation(self) -> bool:
+        self._load()
+        return not self._bearer or time.time() >= self._valid_until - self._margin_seconds
+
+    def mark_valid(self) -> None:
+        """Records a successful validation of the current token."""
+        with self._state_lock:
+            now = time.time()
+            try:
+                # Don't wait: whoever holds the lock is storing a token of their own
+                with self._lock_file(timeout=0):
+                    if not self._write(now, only_if_current=True):
+                        # Another worker stored a new token since we loaded ours; use theirs
+                        self._mtime = None
+                        self._load()
+                        return
+            except LockTimeout:
+                # Trust it in this process only; _load picks up the other worker's write once it lands
+                pass
+            self._valid_until = self._expiry_from(now)
+
+    def invalidate(self) -> None:
+        """Forces the next request to validate (and if needed refresh) the token, e.g. after a 401."""
+        self._load()
+        self._valid_until = 0.0
+
+    def set_token(self, bearer: str) -> None:
+        with self._lock_file(timeout=self._refresh_wait_seconds):
+            self._store(bearer)
+
+    def _store(self, bearer: str) -> None:
+        # Saves a freshly validated token; the caller holds the config file lock
+        with self._state_lock:
+            now = time.time()
+            self._bearer = bearer
+            self._write(now)
+            self._valid_until = self._expiry_from(now)
+
+    def _validated(self, response) -> Optional[bool]:
+        # Trusts the token only on a conclusive test; when upstream can't say, keep using it untrusted
+        status = token_status(response)
+        if status:
+            logger.success("Existing Token valid!")
+            self.mark_valid()
+        elif status is None:
+            logger.warning(f"Couldn't validate token, upstream answered {response.status_code}. Using it as is")
+        return status
+
+    def ensure_valid(self) -> dict:
+        """Returns auth headers, only hitting test_token when the token is close to expiring."""
+        if not self.needs_validation():
+            return self.headers()
+
+        logger.info("Token near expiry or unverified. Testing token...")
+        if self._bearer:
+            response = functions.test_token(self.headers(), self.tenant)
+            if self._validated(response) is not False:
+                return self.headers()
+
+        return self.refresh(stale_bearer=self._bearer)
+
+    async def ensure_valid_async(self) -> dict:
+        """Async version of ensure_valid; the browser login runs in the login executor."""
+        if not self.needs_validation():
+            return self.headers()
+
+        logger.info("Token near expiry or unverified. Testing token...")
+        if self._bearer:
+            response = await functions.test_token_async(self.headers(), self.tenant)
+            if self._validated(response) is not False:
+                return self.headers()
+
+        return await self.refresh_async(stale_bearer=self._bearer)
+
+    def renewal_due_in(self) -> float:
+        """Seconds until renew_async should run so requests never find the token expired."""
+        self._load()
+        return self._valid_until - self._margin_seconds - self._renew_ahead_seconds - time.time()
+
+    async def renew_async(self) -> dict:
+        """Renews the token ahead of time: a new login if it carries an exp claim, otherwise a re-validation."""
+        self._load()
+        if self._bearer and get_token_expiry(self._bearer) is None:
+            response = await functions.test_token_async(self.headers(), self.tenant)
+            status = self._validated(response)
+            if status:
+                return self.headers()
+            if status is None:
+                # Retried with backoff by the renewal loop; a browser login wouldn't help
+                raise TokenError(f"Couldn't validate token, upstream answered {response.status_code}")
+        logger.info(f"Renewing token for {self.tenant.name}")
+        return await self.refresh_async(stale_bearer=self._bearer)
+
+    async def refresh_async(self, stale_bearer: str) -> dict:
+        # Every request in this process awaits the same refresh
+        if self._refresh_future is None or self._refresh_future.done():
+            loop = asyncio.get_running_loop()
+            # Run in a copy of our context so the browser's timing spans land on the request that started it
+            self._refresh_future = loop.run_in_executor(
+                _login_executor, contextvars.copy_context().run, self.refresh, stale_bearer
+            )
+        try:
+            with timing.span("token_refresh"):
+                return await asyncio.wait_for(
+                    asyncio.shield(self._refresh_future), timeout=self._refresh_wait_seconds
+                )
+        except asyncio.TimeoutError:
+            raise TokenError("Timed out waiting for token refresh")
+
+    def refresh(self, stale_bearer: str) -> dict:
+        """Replaces stale_bearer with a new token, making sure only one browser login runs at a time."""
+        deadline = time.monotonic() + self._refresh_wait_seconds
+        if not self._refresh_lock.acquire(timeout=self._refresh_wait_seconds):
+            raise TokenError("Timed out waiting for token refresh")
+        try:
+            with self._lock_file(timeout=max(deadline - time.monotonic(), 0)):
+                # Another request or worker may have refreshed the token while we waited
+                self._mtime = None
+                self._load()
+                if self._bearer and self._bearer != stale_bearer and not self.needs_validation():
+                    logger.success("Token was refreshed by another worker")
+                    return self.headers()
+
+                logger.warning(f"Token for {self.tenant.name} invalid. Generating new token...")
+                new_token = get_bearer.get_token(self.tenant, stale_bearer=self._bearer)
+                if not new_token:
+                    raise TokenError("Failed to obtain a new token")
+                if not token_status(functions.test_token({"Authorization": new_token}, self.tenant)):
+                    raise TokenError("New token is invalid")
+                logger.success("New Token valid! Updating configuration file...")
+                self._store(new_token)
+                return self.headers()
+        except LockTimeout:
+            raise TokenError("Timed out waiting for token refresh")
+        finally:
+            self._refresh_lock.release()
+
+
+_managers: Dict[int, TokenManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(tenant: Optional[tenants.Tenant] = None) -> TokenManager:
+    """Returns the TokenManager for a tenant, one per employee for the life of the process."""
+    tenant = tenant or tenants.default_tenant()
+    with _managers_lock:
+        manager = _managers.get(tenant.employee_id)
+        if manager is None:
+            manager = _managers[tenant.employee_id] = TokenManager(tenant)
+        return manager
+
+
+# The default tenant's manager, used by the command line scripts
+token_manager = get_token_manager()
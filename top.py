@@ -1,9 +1,23 @@
+import log_config
+log_config.setup_logging(log_config.SCRIPT_LOG_FILE)
 import functions
 import get_schedule
 import get_posted_shifts
 import config_file
+import tenants
+from loguru import logger
+from token_manager import TokenError
 
+# One-shot run for every tenant, e.g. from cron. `python scheduler.py` keeps running and repeats both jobs instead.
 functions.check_cfg_file()
-if config_file.run_posted_shifts:
-    get_posted_shifts.get_posted_shifts()
-get_schedule.start_get_schedule()
+try:
+    for tenant in tenants.all_tenants():
+        if config_file.run_posted_shifts and not get_posted_shifts.get_posted_shifts(tenant):
+            exit(-2)
+        if not get_schedule.start_get_schedule(tenant):
+            exit(-2)
+except TokenError as e:
+    logger.error(f"{str(e)}! Exiting...")
+    exit(-1)
+logger.success("Script Complete, Exiting Gracefully...")
+exit(0)
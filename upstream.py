@@ -0,0 +1,218 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+from loguru import logger
+
+import config_file
+import metrics
+import rate_limiter
+
+# Timeouts (seconds) for calls to Target's APIs
+UPSTREAM_CONNECT_TIMEOUT = getattr(config_file, "UPSTREAM_CONNECT_TIMEOUT", 5)
+UPSTREAM_READ_TIMEOUT = getattr(config_file, "UPSTREAM_READ_TIMEOUT", 20)
+# Connection pool shared by every upstream call; connections are kept per host
+UPSTREAM_MAX_CONNECTIONS = getattr(config_file, "UPSTREAM_MAX_CONNECTIONS", 20)
+UPSTREAM_KEEPALIVE_SECONDS = getattr(config_file, "UPSTREAM_KEEPALIVE_SECONDS", 60)
+# Retries for 429/5xx answers and connection failures, with exponential backoff between them
+UPSTREAM_RETRIES = getattr(config_file, "UPSTREAM_RETRIES", 3)
+UPSTREAM_BACKOFF_SECONDS = getattr(config_file, "UPSTREAM_BACKOFF_SECONDS", 0.5)
+UPSTREAM_MAX_BACKOFF_SECONDS = getattr(config_file, "UPSTREAM_MAX_BACKOFF_SECONDS", 10)
+# A Retry-After longer than this is not waited for, the response is returned as is
+UPSTREAM_MAX_RETRY_AFTER_SECONDS = getattr(config_file, "UPSTREAM_MAX_RETRY_AFTER_SECONDS", 30)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses that mean the request wasn't processed, so even a POST can safely be sent again
+SAFE_RETRY_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+_async_client: Optional[httpx.AsyncClient] = None
+_client: Optional[httpx.Client] = None
+_client_lock = threading.Lock()
+
+
+def get_timeout(read_timeout: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(
+        read_timeout or UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT
+    )
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_SECONDS,
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Returns the shared keep-alive client, creating it on first use."""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(timeout=get_timeout(), limits=_limits())
+    return _async_client
+
+
+def get_client() -> httpx.Client:
+    """Thread-safe keep-alive client for the synchronous scripts."""
+    global _client
+    with _client_lock:
+        if _client is None or _client.is_closed:
+            _client = httpx.Client(timeout=get_timeout(), limits=_limits())
+        return _client
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(attempt: int) -> float:
+    # Full jitter so callers retrying together spread out
+    return random.uniform(0, min(UPSTREAM_BACKOFF_SECONDS * 2 ** attempt, UPSTREAM_MAX_BACKOFF_SECONDS))
+
+
+def _retry_delay(method: str, attempt: int, retries: int, response=None, error=None) -> Optional[float]:
+    # Seconds to wait before attempt + 1, or None if the outcome should be returned (or raised) as is
+    if attempt >= retries:
+        return None
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+    if error is not None:
+        # A connection that never opened can always be retried, anything later only when idempotent
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)) or (
+            idempotent and isinstance(error, httpx.TransportError)
+        ):
+            return _backoff(attempt)
+        return None
+
+    statuses = RETRY_STATUSES if idempotent else SAFE_RETRY_STATUSES
+    if response.status_code not in statuses:
+        return None
+    retry_after = _retry_after(response)
+    if retry_after is None:
+        return _backoff(attempt)
+    if retry_after > UPSTREAM_MAX_RETRY_AFTER_SECONDS:
+        return None
+    return retry_after
+
+
+def _record(host: str, start: float, status) -> None:
+    metrics.upstream_requests.inc(host, str(status))
+    metrics.upstream_duration.observe(time.perf_counter() - start, host)
+
+
+def _log_retry(method: str, url: str, delay: float, response=None, error=None) -> None:
+    host = httpx.URL(url).host
+    reason = f"status {response.status_code}" if response is not None else type(error).__name__
+    logger.warning(f"{method} {host} failed with {reason}, retrying in {delay:.1f}s")
+
+
+def request(
+    method: str, url: str, timeout: Optional[float] = None, retries: Optional[int] = None, **kwargs
+) -> httpx.Response:
+    """Sends a request on the shared client, retrying 429/5xx answers and connection failures.
+
+    Every attempt waits its turn in the host's rate limiter, raising rate_limiter.RateLimited
+    if that would take longer than RATE_LIMIT_WAIT_SECONDS.
+    """
+    retries = UPSTREAM_RETRIES if retries is None else retries
+    host = httpx.URL(url).host
+    bucket = rate_limiter.get_bucket(host)
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        start = time.perf_counter()
+        try:
+            response = get_client().request(method, url, timeout=get_timeout(timeout), **kwargs)
+        except httpx.TransportError as e:
+            _record(host, start, "error")
+            delay = _retry_delay(method, attempt, retries, error=e)
+            if delay is None:
+                raise
+            _log_retry(method, url, delay, error=e)
+        else:
+            _record(host, start, response.status_code)
+            delay = _retry_delay(method, attempt, retries, response=response)
+            if delay is None:
+                return response
+            _log_retry(method, url, delay, response=response)
+            response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def request_async(
+    method: str, url: str, timeout: Optional[float] = None, retries: Optional[int] = None, **kwargs
+) -> httpx.Response:
+    """Async version of request, on the shared async client."""
+    retries = UPSTREAM_RETRIES if retries is None else retries
+    host = httpx.URL(url).host
+    bucket = rate_limiter.get_bucket(host)
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await bucket.acquire_async()
+        start = time.perf_counter()
+        try:
+            response = await get_async_client().request(method, url, timeout=get_timeout(timeout), **kwargs)
+        except httpx.TransportError as e:
+            _record(host, start, "error")
+            delay = _retry_delay(method, attempt, retries, error=e)
+            if delay is None:
+                raise
+            _log_retry(method, url, delay, error=e)
+        else:
+            _record(host, start, response.status_code)
+            delay = _retry_delay(method, attempt, retries, response=response)
+            if delay is None:
+                return response
+            _log_retry(method, url, delay, response=response)
+            await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def get(url: str, headers: Optional[dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+    return request("GET", url, headers=headers, timeout=timeout)
+
+
+def post(url: str, data: Optional[dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+    return request("POST", url, data=data, timeout=timeout)
+
+
+async def get_async(url: str, headers: Optional[dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+    return await request_async("GET", url, headers=headers, timeout=timeout)
+
+
+async def post_async(url: str, data: Optional[dict] = None, timeout: Optional[float] = None) -> httpx.Response:
+    return await request_async("POST", url, data=data, timeout=timeout)
+
+
+async def close_async_client() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def close_client() -> None:
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None